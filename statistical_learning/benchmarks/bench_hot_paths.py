@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the presentation hot paths of statistical_learning_demo.py.
+
+Runs with the dummy SDL video and audio drivers, so it needs no display or
+sound card, and measures:
+- text_wrap_blit of the welcome.txt instructions, with the layout cache cold
+  (every word rendered) and warm
+- composing (render) and showing (blit and update) each kind of screen
+- loading each stimulus with pygame.mixer.Sound
+- the time from the end of ISI() to the start of the trial audio, with the
+  stimuli decoded ahead as in a session. The output latency of the sound
+  card, which the dummy driver does not have, comes on top of it.
+- write_responses as the results folder grows
+
+Every benchmark is timed repeat times and summarized by its median in
+milliseconds (lower is better). Results can be saved as a .json baseline,
+which records the Python, pygame and SDL versions, and a later run can be
+compared to a baseline, e.g. after a pygame or SDL upgrade. A benchmark is
+a regression if its median is more than threshold slower than the baseline
+(and by at least min_ms); the comparison then exits with status 1. The
+demo runs from a scratch copy of its stimulus and instructions folders, so
+its startup cache (mixer calibration, decoded stimuli) and results folder
+are never touched.
+
+    python benchmarks/bench_hot_paths.py --save benchmarks/baselines/lab1.json
+    python benchmarks/bench_hot_paths.py --compare benchmarks/baselines/lab1.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+from statistics import median
+from collections import OrderedDict
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+# folder that holds the demo module
+demo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, demo_path)
+import pygame
+import statistical_learning_demo as demo
+import virtual_clock
+
+# screen size used for every run, so results do not depend on the display
+screen_size = (1920, 1080)
+
+# one screen of each kind (see make_screen)
+screen_names = ("instructions", "blank", "response", "training", "continue", "ready", "trial 1", "results 6/8")
+
+# a benchmark is a regression if it is more than threshold (a fraction)
+# slower than the baseline, and by at least min_ms
+threshold = 0.25
+min_ms = 0.05
+
+
+def timed(function, *args):
+    """calls function(*args) and returns the time it took in milliseconds."""
+    start_ns = time.perf_counter_ns()
+    function(*args)
+    return (time.perf_counter_ns() - start_ns) / 1e6
+
+
+class OnsetClock(virtual_clock.PygameClock):
+    """
+    The real clock, except that every sound is stopped as soon as it has
+    started, so a trial does not wait for its whole stimulus. The time each
+    sound was started is kept in onset_ns.
+    """
+
+    onset_ns = None
+
+    def play(self, channel: pygame.mixer.Channel, sound: pygame.mixer.Sound, length_ms: float):
+        super().play(channel, sound, length_ms)
+        self.onset_ns = time.perf_counter_ns()
+        # stopping the channel posts its end event
+        channel.stop()
+
+
+def bench_text_wrap(repeat: int):
+    """text_wrap_blit of welcome.txt onto a full screen surface."""
+    with open(demo.session_config["instruction_file"], 'r') as file:
+        text = file.read()
+    surface = pygame.Surface(screen_size).convert()
+    args = (surface, text, demo.exp_globals["font"], screen_size[0] - 100, (50, 50), demo.exp_globals["text_color"])
+    cold = []
+    for k in range(repeat):
+        demo.text_cache["layouts"].clear()
+        cold.append(timed(demo.text_wrap_blit, *args))
+    warm = [timed(demo.text_wrap_blit, *args) for k in range(repeat)]
+    return {"text_wrap_blit cold": cold, "text_wrap_blit warm": warm}
+
+
+def bench_screens(repeat: int):
+    """
+    Composing each kind of screen, and showing it after the blank screen.
+    Updates are not paced, so only the cost of the update is measured.
+    """
+    samples = OrderedDict()
+    clock = demo.exp_globals["clock"]
+    demo.exp_globals["clock"] = None
+    for name in screen_names:
+        render = []
+        show = []
+        for k in range(repeat):
+            demo.text_cache["lines"].clear()
+            demo.text_cache["layouts"].clear()
+            render.append(timed(demo.make_screen, name))
+            demo.show_screen("blank" if name != "blank" else "response")
+            show.append(timed(demo.show_screen, name))
+        samples["render " + name] = render
+        samples["show " + name] = show
+    demo.exp_globals["clock"] = clock
+    return samples
+
+
+def bench_sound_loads(repeat: int):
+    """pygame.mixer.Sound of each stimulus in the manifest."""
+    samples = OrderedDict()
+    for name in sorted(demo.session_config["manifest"]["files"]):
+        audio_file = os.path.join(demo.session_config["audio_path"], name)
+        samples["Sound " + name] = [timed(pygame.mixer.Sound, audio_file) for k in range(repeat)]
+    return samples
+
+
+def bench_isi_to_onset(repeat: int, isi_ms: int):
+    """
+    Time from the end of ISI() to the start of the trial audio for each test
+    file, with the stimuli decoded ahead and the screen updates paced, as in
+    a session.
+    """
+    demo.preload_stimuli(demo.stimulus_paths())
+    demo.exp_globals["decoder"].wait()
+    clock = OnsetClock()
+    demo.exp_globals["events"] = clock
+    samples = []
+    for k in range(repeat):
+        for m, audio_file in enumerate(demo.session_config["audio_files"]):
+            demo.ISI(isi_ms)
+            isi_end_ns = time.perf_counter_ns()
+            demo.play_audio(os.path.join(demo.session_config["audio_path"], audio_file), m + 1)
+            samples.append((clock.onset_ns - isi_end_ns) / 1e6)
+    demo.exp_globals["events"] = virtual_clock.PygameClock()
+    return {"ISI end to audio onset": samples}
+
+
+def session_results():
+    """returns the results of a made up session of every test file, in the layout of results_out."""
+    results = OrderedDict((key, None if key in demo.session_keys else []) for key in demo.results_out)
+    for m, audio_file in enumerate(demo.session_config["audio_files"]):
+        trial = {"trial_num": m + 1, "audio_files": audio_file, "responses": 1 + m % 2, "rt": 812,
+                 "rt_flip_ms": 811.5, "rt_onset_ms": 4812.25, "rt_offset_ms": 811.75, "rt_word2_end_ms": 1203.0,
+                 "end_event_delay_ms": demo.mixer_config["end_event_delay_ms"]}
+        for key in results:
+            if key not in demo.session_keys:
+                results[key].append(trial.get(key))
+    return results
+
+
+def bench_write_responses(repeat: int, sizes: list):
+    """
+    write_responses into the scratch results folder, timed repeat times once the
+    folder holds each number of sessions in sizes.
+    """
+    samples = OrderedDict()
+    n_sessions = 0
+    for size in sorted(sizes):
+        while n_sessions < size:
+            demo.write_responses(session_results())
+            n_sessions += 1
+        samples["write_responses at {} sessions".format(size)] = [timed(demo.write_responses, session_results()) for k in range(repeat)]
+        n_sessions += repeat
+    return samples
+
+
+def environment():
+    """returns the versions and machine the benchmarks ran on."""
+    return {"python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "sdl": ".".join(str(part) for part in pygame.get_sdl_version()),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "mixer": pygame.mixer.get_init(),
+            "mixer_buffer": demo.mixer_config["buffer"],
+            "end_event_delay_ms": demo.mixer_config["end_event_delay_ms"],
+            "started": time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def summarize(samples: list):
+    """returns the median, min, max and count of a list of times in ms."""
+    return {"median_ms": round(median(samples), 4), "min_ms": round(min(samples), 4),
+            "max_ms": round(max(samples), 4), "n": len(samples)}
+
+
+def scratch_base():
+    """
+    Returns a new temporary base folder with copies of the stimulus and
+    instructions folders of the demo, for the demo to run from.
+    """
+    base_path = tempfile.mkdtemp(prefix = 'bench-base-')
+    for folder in ("demo_audio", "instructions"):
+        shutil.copytree(os.path.join(demo_path, folder), os.path.join(base_path, folder))
+    return base_path
+
+
+def run_benchmarks(repeat: int, isi_ms: int, sizes: list, base_path: str):
+    """
+    Sets up the demo in the scratch folder base_path and runs every
+    benchmark. Returns the environment and the summary of each benchmark by
+    name.
+    """
+    demo.configure_session(base_path, debug = True, randomize = False, trace = False)
+    os.makedirs(demo.session_config["results_path"], exist_ok = True)
+    demo.init_pygame(screen_size, demo.exp_globals["FPS"])
+    samples = OrderedDict()
+    samples.update(bench_text_wrap(repeat))
+    samples.update(bench_screens(repeat))
+    samples.update(bench_sound_loads(repeat))
+    samples.update(bench_isi_to_onset(max(1, repeat // 10), isi_ms))
+    samples.update(bench_write_responses(repeat, sizes))
+    run = {"environment": environment(), "benchmarks": OrderedDict((name, summarize(times)) for name, times in samples.items())}
+    demo.close_decoder()
+    pygame.mixer.quit()
+    pygame.quit()
+    return run
+
+
+def compare(results: dict, baseline: dict, threshold: float = threshold, min_ms: float = min_ms):
+    """
+    Compares results to a baseline and returns a list of (name, baseline ms,
+    ms, ratio, regression) for every benchmark in both.
+    results: dict of benchmark summaries from run_benchmarks
+    baseline: dict of benchmark summaries from a saved baseline
+    """
+    rows = []
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        old_ms = baseline[name]["median_ms"]
+        new_ms = summary["median_ms"]
+        ratio = new_ms / old_ms if old_ms > 0 else float('inf')
+        rows.append((name, old_ms, new_ms, ratio, ratio > 1 + threshold and new_ms - old_ms >= min_ms))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "benchmark the presentation hot paths of the statistical learning demo")
+    parser.add_argument("--repeat", type = int, default = 30, help = "runs per benchmark")
+    parser.add_argument("--isi", type = int, default = 500, help = "ISI duration in ms for the ISI to onset benchmark")
+    parser.add_argument("--sizes", default = "0,100,1000", help = "results folder sizes (sessions) for write_responses")
+    parser.add_argument("--save", default = None, metavar = "FILE", help = "save the results as a .json baseline")
+    parser.add_argument("--compare", default = None, metavar = "FILE", help = "compare the results to a .json baseline")
+    parser.add_argument("--threshold", type = float, default = threshold, help = "slowdown (fraction) that counts as a regression")
+    args = parser.parse_args()
+
+    base_path = scratch_base()
+    try:
+        run = run_benchmarks(args.repeat, args.isi, [int(size) for size in args.sizes.split(',')], base_path)
+    finally:
+        shutil.rmtree(base_path, ignore_errors = True)
+    results = run["benchmarks"]
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok = True)
+        with open(args.save, 'w') as file:
+            json.dump(run, file, indent = 1)
+            file.write('\n')
+
+    if not args.compare:
+        print("{:<45} {:>12} {:>12} {:>12}".format("benchmark", "median_ms", "min_ms", "max_ms"))
+        for name, summary in results.items():
+            print("{:<45} {:>12.4f} {:>12.4f} {:>12.4f}".format(name, summary["median_ms"], summary["min_ms"], summary["max_ms"]))
+        return
+
+    with open(args.compare, 'r') as file:
+        baseline = json.load(file)
+    for key in ("python", "pygame", "sdl"):
+        if baseline["environment"][key] != run["environment"][key]:
+            print("{}: {} in the baseline, {} now".format(key, baseline["environment"][key], run["environment"][key]))
+    rows = compare(results, baseline["benchmarks"], args.threshold)
+    print("{:<45} {:>12} {:>12} {:>8}".format("benchmark", "baseline_ms", "median_ms", "ratio"))
+    for name, old_ms, new_ms, ratio, regression in rows:
+        print("{:<45} {:>12.4f} {:>12.4f} {:>8.2f}{}".format(name, old_ms, new_ms, ratio, "  REGRESSION" if regression else ""))
+    regressions = sum(row[4] for row in rows)
+    print("{} benchmarks compared, {} regressions".format(len(rows), regressions))
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Startup time benchmark for statistical_learning_demo.py.
+
+Each measurement runs in a fresh Python process so that nothing is shared
+between runs except the startup cache on disk. It compares the old startup
+steps (a Tk root for the screen size, pygame.font.SysFont, listing the audio
+folder) with the new ones (pygame display info, the cached font path, the
+stimulus manifest), with the startup cache cold (deleted) and warm. The
+runs use a scratch copy of the stimulus and instructions folders, so the
+startup cache of the demo folder (mixer calibration, decoded stimuli) is
+never touched.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+
+# folder that holds the demo module
+demo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# code run in the child process for each measurement. Each prints a dict of
+# stage -> seconds as JSON on its last line.
+stages = {
+"import": """
+import time
+t = time.perf_counter()
+import statistical_learning_demo
+print(json.dumps({"import": time.perf_counter() - t}))
+""",
+"old": """
+import time, pygame
+stages = {}
+t = time.perf_counter()
+try:
+    from tkinter import Tk
+    root = Tk()
+    size = (root.winfo_screenwidth(), root.winfo_screenheight())
+    root.destroy()
+    stages["screen size (Tk)"] = time.perf_counter() - t
+except Exception:
+    pass
+pygame.init()
+t = time.perf_counter()
+pygame.font.SysFont("Arial", 50)
+stages["font (SysFont)"] = time.perf_counter() - t
+t = time.perf_counter()
+audio_files = sorted(f for f in os.listdir(os.path.join(base_path, "demo_audio")) if f.endswith(".wav") and f.startswith("Q"))
+stages["audio scan (listdir)"] = time.perf_counter() - t
+print(json.dumps(stages))
+""",
+"new": """
+import time, pygame
+import statistical_learning_demo as demo
+stages = {}
+t = time.perf_counter()
+demo.configure_session(base_path, debug = True)
+stages["configure_session"] = time.perf_counter() - t
+pygame.init()
+t = time.perf_counter()
+info = pygame.display.Info()
+stages["screen size (display info)"] = time.perf_counter() - t
+t = time.perf_counter()
+pygame.font.Font(demo.cached_font_path("Arial"), 50)
+stages["font (cached path)"] = time.perf_counter() - t
+print(json.dumps(stages))
+""",
+}
+
+
+def scratch_base():
+    """
+    Returns a new temporary base folder with copies of the stimulus and
+    instructions folders of the demo, for the demo to run from.
+    """
+    base_path = tempfile.mkdtemp(prefix = 'bench-base-')
+    for folder in ("demo_audio", "instructions"):
+        shutil.copytree(os.path.join(demo_path, folder), os.path.join(base_path, folder))
+    return base_path
+
+
+def run_stage(name: str, base_path: str):
+    """runs one stage in a fresh process with the demo in base_path and returns its timings."""
+    code = "import os, sys, json\nsys.path.insert(0, {!r})\nbase_path = {!r}\n".format(demo_path, base_path) + stages[name]
+    output = subprocess.run([sys.executable, "-c", code], capture_output = True, text = True, check = True, cwd = base_path)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def clear_cache(base_path: str):
+    shutil.rmtree(os.path.join(base_path, ".cache"), ignore_errors = True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "benchmark the startup of the statistical learning demo")
+    parser.add_argument("--repeat", type = int, default = 5, help = "runs per measurement")
+    args = parser.parse_args()
+
+    timings = {}
+    base_path = scratch_base()
+    try:
+        for label, name, cold in (("import", "import", False), ("old", "old", False),
+                                  ("new, cold cache", "new", True), ("new, warm cache", "new", False)):
+            runs = []
+            for k in range(args.repeat):
+                if cold:
+                    clear_cache(base_path)
+                runs.append(run_stage(name, base_path))
+            for stage in runs[0]:
+                timings[label + ": " + stage] = median(run[stage] for run in runs) * 1000
+    finally:
+        shutil.rmtree(base_path, ignore_errors = True)
+
+    for stage, ms in timings.items():
+        print("{:<50} {:>10.2f} ms".format(stage, ms))
+
+
+if __name__ == '__main__':
+    main()
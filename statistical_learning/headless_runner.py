@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Runs statistical_learning_demo.py headless with simulated participants.
+
+The experiment runs with the dummy SDL video and audio drivers and without
+Tk, so no display or sound card is needed. Key presses come from a simulated
+participant (see simulated_participants.py) and every session writes its
+results through the normal write_responses function. Sessions are spread
+over a pool of worker processes, and each worker initializes pygame once and
+then runs its sessions back to back.
+
+Example, 5000 sessions of a learner that is correct 70% of the time:
+    python headless_runner.py --sessions 5000 --learner oracle --accuracy 0.7
+Example, a transitional probability learner:
+    python headless_runner.py --learner tp --transcription transcription.json
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# folder that holds this module, the demo module and its subfolders
+demo_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_learner(learner: str, answer_key: dict, accuracy: float, transcription: str, noise: float, seed: int):
+    """
+    Returns a new simulated participant.
+    learner: str naming the learner, one of 'random', 'oracle' or 'tp'
+    answer_key: dict mapping test audio file names to the correct sound
+    accuracy: float representing the accuracy of the oracle learner
+    transcription: str representing the path to the transcription used by 'tp'
+    noise: float representing the score noise of the 'tp' learner
+    seed: int used to seed the learner
+    """
+    import simulated_participants as sp
+    if learner == 'random':
+        return sp.RandomLearner(seed)
+    elif learner == 'oracle':
+        return sp.OracleLearner(answer_key, accuracy, seed)
+    elif learner == 'tp':
+        training, test_items = sp.load_transcription(transcription)
+        return sp.TPLearner(training, test_items, noise, seed)
+    raise ValueError("unknown learner: " + learner)
+
+
+def run_batch(n_sessions: int, options: dict, seed: int):
+    """
+    Runs n_sessions headless sessions in this process and returns the number
+    of sessions run. pygame is initialized once for the whole batch.
+    n_sessions: int representing the number of sessions to run
+    options: dict of command line options (see main)
+    seed: int used to seed the learners of this batch
+    """
+    sys.path.insert(0, demo_path)
+    import statistical_learning_demo as demo
+    demo.configure_session(results_path = options["results"], headless = True)
+
+    demo.init_pygame(demo.exp_globals["screen_size"], demo.exp_globals["FPS"])
+    for k in range(n_sessions):
+        demo.reset_session()
+        demo.exp_globals["participant"] = make_learner(options["learner"], demo.answer_key, options["accuracy"], options["transcription"], options["noise"], seed + k)
+        demo.run_session()
+    demo.close_decoder()
+    demo.pygame.quit()
+    return n_sessions
+
+
+def run_sessions(n_sessions: int, options: dict, workers: int = None, batch_size: int = 100, seed: int = 0):
+    """
+    Spreads n_sessions over a pool of worker processes in batches of
+    batch_size sessions. Returns the number of sessions run.
+    n_sessions: int representing the total number of sessions
+    options: dict of command line options (see main)
+    workers: int representing the number of worker processes, None uses all cores
+    batch_size: int representing the number of sessions per batch
+    seed: int used to seed the learners
+    """
+    batches = [min(batch_size, n_sessions - start) for start in range(0, n_sessions, batch_size)]
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(run_batch, n, options, seed + k * batch_size) for k, n in enumerate(batches)]
+        return sum(future.result() for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "run the statistical learning demo with simulated participants")
+    parser.add_argument("--sessions", type = int, default = 1000, help = "number of sessions to run")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type = int, default = 100, help = "sessions per worker batch")
+    parser.add_argument("--learner", choices = ("random", "oracle", "tp"), default = "oracle")
+    parser.add_argument("--accuracy", type = float, default = 0.75, help = "accuracy of the oracle learner")
+    parser.add_argument("--transcription", default = None, help = "transcription .json for the tp learner")
+    parser.add_argument("--noise", type = float, default = 0.0, help = "score noise of the tp learner")
+    parser.add_argument("--results", default = None, help = "results folder (default: demo_results)")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    if args.learner == "tp" and args.transcription is None:
+        parser.error("--learner tp needs --transcription")
+
+    options = {"learner": args.learner,
+               "accuracy": args.accuracy,
+               "transcription": args.transcription and os.path.abspath(args.transcription),
+               "noise": args.noise,
+               "results": args.results and os.path.abspath(args.results),
+    }
+    results_dir = options["results"] or os.path.join(demo_path, "demo_results")
+    os.makedirs(results_dir, exist_ok = True)
+
+    start_time = time.perf_counter()
+    n_run = run_sessions(args.sessions, options, args.workers, args.batch_size, args.seed)
+    elapsed = time.perf_counter() - start_time
+    print("{} sessions in {:.1f} s ({:.0f} sessions per minute)".format(n_run, elapsed, n_run / elapsed * 60))
+
+
+if __name__ == '__main__':
+    main()
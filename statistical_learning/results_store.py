@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Indexed results store for statistical_learning_demo.py.
+
+Trials are kept in a SQLite database named results.sqlite3 inside the results
+folder. Every write takes the write lock first (BEGIN IMMEDIATE), so several
+stations can write to the same store. On a local disk the database runs in
+WAL mode, so readers never block the writer. WAL mode needs memory shared by
+every process that opens the database, which stations on different machines
+do not have, so a results folder on a network share (SMB or NFS) is detected
+and its database runs in the rollback journal mode (DELETE) instead, which
+relies on the file locks of the share. Detection covers network mounts on
+Linux and network drives and UNC paths on Windows; on other systems a shared
+folder must be mounted so that it shows up as one of those, or only be used
+by one station at a time. Participant IDs (PIDs) are allocated atomically
+from the sessions table, so they never depend on how many files are in the
+folder. Trials are indexed by PID, by stimulus and by session date.
+
+The exporter writes a session in the same layout as the results#.csv files
+that the demo has always written. From the command line:
+    python results_store.py demo_results --pid 12
+    python results_store.py demo_results --all
+"""
+import os
+import re
+import csv
+import sqlite3
+import argparse
+from datetime import datetime
+from itertools import zip_longest
+
+# name of the database file in the results folder
+store_name = 'results.sqlite3'
+
+# open connections by database path, so each process opens a store only once
+connections = {}
+
+# types of the network file systems in /proc/mounts, on which WAL mode cannot
+# be used
+network_filesystems = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', '9p', 'ncpfs', 'fuse.sshfs', 'fuse.davfs2'}
+
+
+def on_network_share(path: str):
+    """
+    Returns True if path is on a network file system: a UNC path or a network
+    drive on Windows, or a mount of one of network_filesystems on Linux.
+    Returns False when this cannot be found out.
+    path: str representing the full path to a folder
+    """
+    path = os.path.realpath(path)
+    if os.name == 'nt':
+        drive = os.path.splitdrive(path)[0]
+        if drive.startswith('\\\\'):
+            return True
+        import ctypes
+        # DRIVE_REMOTE
+        return ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == 4
+    try:
+        with open('/proc/mounts', 'r') as file:
+            mounts = [line.split()[1:3] for line in file]
+    except OSError:
+        return False
+    # the longest mount point that holds path is the file system of path
+    mount_point, fs_type = '', ''
+    for point, kind in mounts:
+        point = point.replace('\\040', ' ')
+        if (path == point or path.startswith(point.rstrip('/') + '/')) and len(point) > len(mount_point):
+            mount_point, fs_type = point, kind
+    return fs_type in network_filesystems
+
+
+def journal_mode(results_path: str):
+    """
+    Returns the SQLite journal mode for databases in results_path: DELETE on a
+    network share, where WAL mode does not work, and WAL otherwise.
+    results_path: str representing the full path to the results folder
+    """
+    return 'DELETE' if on_network_share(results_path) else 'WAL'
+
+
+def open_store(results_path: str):
+    """
+    Opens (and creates if needed) the results store in results_path and
+    returns the connection. A new store continues numbering after the highest
+    existing results#.csv file so that old and new PIDs never clash. This is
+    the only time the folder is listed.
+    results_path: str representing the full path to the results folder
+    """
+    db_path = os.path.join(results_path, store_name)
+    if db_path in connections:
+        return connections[db_path]
+
+    # the connection may be used by the trial journal writer thread as well
+    conn = sqlite3.connect(db_path, timeout = 30, isolation_level = None, check_same_thread = False)
+    mode = journal_mode(results_path)
+    conn.execute("PRAGMA journal_mode=" + mode)
+    # NORMAL is only safe with WAL, a rollback journal syncs every commit
+    conn.execute("PRAGMA synchronous=" + ("NORMAL" if mode == 'WAL' else "FULL"))
+    # create the schema and seed the PIDs in one write transaction, so two
+    # stations opening a new store at the same time do not both seed it
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                        PID INTEGER PRIMARY KEY AUTOINCREMENT,
+                        started TEXT NOT NULL,
+                        session_date TEXT NOT NULL,
+                        columns TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS trials (
+                        PID INTEGER NOT NULL,
+                        trial_num INTEGER NOT NULL,
+                        audio_files TEXT,
+                        PRIMARY KEY (PID, trial_num))""")
+    conn.execute("CREATE INDEX IF NOT EXISTS trials_audio_files ON trials (audio_files)")
+    conn.execute("CREATE INDEX IF NOT EXISTS sessions_date ON sessions (session_date)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone() is None:
+        last_pid = highest_csv_pid(results_path)
+        if last_pid:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('sessions', ?)", (last_pid,))
+        conn.execute("INSERT INTO meta (key, value) VALUES ('seeded', ?)", (str(last_pid),))
+    conn.execute("COMMIT")
+    connections[db_path] = conn
+    return conn
+
+
+def highest_csv_pid(results_path: str):
+    """
+    Returns the highest # of the results#.csv files in results_path, or 0.
+    results_path: str representing the full path to the results folder
+    """
+    pids = [int(match.group(1)) for match in (re.fullmatch(r'results(\d+)\.csv', file) for file in os.listdir(results_path)) if match]
+    return max(pids, default = 0)
+
+
+def allocate_pid(conn: sqlite3.Connection):
+    """
+    Atomically allocates the next PID and records the start of its session.
+    The insert is a single statement, so two stations never get the same PID.
+    """
+    now = datetime.now()
+    cursor = conn.execute("INSERT INTO sessions (started, session_date) VALUES (?, ?)",
+                          (now.isoformat(timespec = 'seconds'), now.date().isoformat()))
+    return cursor.lastrowid
+
+
+def trial_columns(conn: sqlite3.Connection):
+    """returns the names of the columns of the trials table."""
+    return [row[1] for row in conn.execute("PRAGMA table_info(trials)")]
+
+
+def write_session(conn: sqlite3.Connection, PID: int, results: dict):
+    """
+    Writes all trials of a session in one transaction. Result keys that the
+    trials table does not have yet are added as new columns, so the store
+    follows the keys of results_out in the demo.
+    PID: int representing the participant number from allocate_pid
+    results: dictionary representing the trial by trial data and results
+    """
+    keys = [key for key in results.keys() if key != "PID"]
+    rows = [(PID,) + row for row in zip_longest(*(results[key] for key in keys))]
+    # take the write lock before looking at the columns, so that two stations
+    # do not both try to add the same new column
+    conn.execute("BEGIN IMMEDIATE")
+    known = trial_columns(conn)
+    for key in keys:
+        if key not in known:
+            conn.execute('ALTER TABLE trials ADD COLUMN "{}"'.format(key))
+    conn.executemany('INSERT INTO trials ("PID", {}) VALUES (?, {})'.format(
+                     ', '.join('"{}"'.format(key) for key in keys), ', '.join('?' * len(keys))), rows)
+    conn.execute("UPDATE sessions SET columns = ? WHERE PID = ?", (','.join(["PID"] + keys), PID))
+    conn.execute("COMMIT")
+
+
+def session_columns(conn: sqlite3.Connection, PID: int):
+    """returns the result keys of a session in the order they were written."""
+    row = conn.execute("SELECT columns FROM sessions WHERE PID = ?", (PID,)).fetchone()
+    if row is None or not row[0]:
+        return trial_columns(conn)
+    return row[0].split(',')
+
+
+def trials_for_pid(conn: sqlite3.Connection, PID: int):
+    """returns the trials of one participant as rows of the session columns."""
+    columns = session_columns(conn, PID)
+    return conn.execute('SELECT {} FROM trials WHERE PID = ? ORDER BY trial_num'.format(
+                        ', '.join('"{}"'.format(column) for column in columns)), (PID,)).fetchall()
+
+
+def trials_for_stimulus(conn: sqlite3.Connection, audio_file: str):
+    """returns (PID, trial_num, responses, accuracy) for every trial of a stimulus."""
+    return conn.execute("SELECT PID, trial_num, responses, accuracy FROM trials WHERE audio_files = ? ORDER BY PID",
+                        (audio_file,)).fetchall()
+
+
+def sessions_on(conn: sqlite3.Connection, session_date: str):
+    """returns the PIDs of the sessions run on session_date (YYYY-MM-DD)."""
+    return [row[0] for row in conn.execute("SELECT PID FROM sessions WHERE session_date = ? ORDER BY PID", (session_date,))]
+
+
+def export_csv(conn: sqlite3.Connection, PID: int, csv_path: str):
+    """
+    Writes the trials of one participant to csv_path in the results#.csv layout.
+    PID: int representing the participant number
+    csv_path: str representing the full path of the .csv file to write
+    """
+    with open(csv_path, 'w', newline = '') as file:
+        writer = csv.writer(file, delimiter = ",")
+        writer.writerow(session_columns(conn, PID))
+        writer.writerows(trials_for_pid(conn, PID))
+
+
+def save_session(results_path: str, results: dict):
+    """
+    Allocates a PID for a finished session, saves its trials to the store in
+    results_path and exports them as results#.csv. Fills results["PID"] and
+    returns the PID.
+    results_path: str representing the full path to the results folder
+    results: dictionary representing the trial by trial data and results
+    """
+    conn = open_store(results_path)
+    PID = allocate_pid(conn)
+    results["PID"] = [PID] * len(results["responses"])
+    write_session(conn, PID, results)
+    export_csv(conn, PID, os.path.join(results_path, 'results' + str(PID) + ".csv"))
+    return PID
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "export sessions from the results store as results#.csv files")
+    parser.add_argument("results_path", help = "results folder that holds " + store_name)
+    parser.add_argument("--pid", type = int, action = "append", default = [], help = "PID to export (repeatable)")
+    parser.add_argument("--all", action = "store_true", help = "export every session")
+    parser.add_argument("--out", default = None, help = "folder to write to (default: the results folder)")
+    args = parser.parse_args()
+
+    conn = open_store(args.results_path)
+    pids = args.pid
+    if args.all:
+        pids = [row[0] for row in conn.execute("SELECT PID FROM sessions ORDER BY PID")]
+    out_path = args.out or args.results_path
+    for PID in pids:
+        export_csv(conn, PID, os.path.join(out_path, 'results' + str(PID) + ".csv"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""
+Summary of the results#.csv files in a results folder.
+
+Reports the accuracy per stimulus and per participant and the distribution
+of every reaction time column (the columns whose name starts with 'rt').
+The files are read in batches and each batch is reduced with numpy to a few
+counts per file: trials and correct answers, trials and correct answers per
+stimulus, and a 10 ms histogram plus the sum and sum of squares of each RT
+column. These counts are kept in a summary cache (results_summary.sqlite3
+in the results folder) together with the modification time and size of each
+file, so a rerun only reads files that are new or changed, and drops the
+counts of files that were deleted. The summary itself is added up by SQLite
+from the counts, so memory use does not grow with the number of sessions.
+
+    python results_summary.py demo_results
+    python results_summary.py demo_results --participants accuracy.csv
+"""
+import os
+import re
+import csv
+import sqlite3
+import argparse
+import numpy as np
+import results_store
+
+# name of the summary cache in the results folder
+cache_name = 'results_summary.sqlite3'
+
+# RT histograms have bins of bin_ms from rt_min_ms up to rt_max_ms. Values
+# outside go into the first or last bin.
+bin_ms = 10
+rt_min_ms = -5000
+rt_max_ms = 20000
+n_bins = (rt_max_ms - rt_min_ms) // bin_ms
+
+# number of files read and reduced at a time
+batch_size = 2000
+
+# names of the results files
+results_pattern = re.compile(r'results(\d+)\.csv')
+
+
+def open_cache(results_path: str):
+    """
+    Opens (and creates if needed) the summary cache in results_path.
+    results_path: str representing the full path to the results folder
+    """
+    conn = sqlite3.connect(os.path.join(results_path, cache_name), isolation_level = None)
+    # no WAL mode on a network share, see results_store.py
+    conn.execute("PRAGMA journal_mode=" + results_store.journal_mode(results_path))
+    conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                        name TEXT PRIMARY KEY,
+                        mtime_ns INTEGER,
+                        size INTEGER,
+                        PID INTEGER,
+                        n_trials INTEGER,
+                        n_correct INTEGER)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS stimuli (
+                        name TEXT,
+                        stimulus TEXT,
+                        n_trials INTEGER,
+                        n_correct INTEGER,
+                        PRIMARY KEY (name, stimulus))""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS rt_stats (
+                        name TEXT,
+                        rt_column TEXT,
+                        n INTEGER,
+                        total REAL,
+                        total_sq REAL,
+                        PRIMARY KEY (name, rt_column))""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS rt_bins (
+                        name TEXT,
+                        rt_column TEXT,
+                        bin INTEGER,
+                        count INTEGER)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS rt_bins_name ON rt_bins (name)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stimulus_totals (stimulus TEXT PRIMARY KEY, n_trials INTEGER, n_correct INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS rt_totals (rt_column TEXT PRIMARY KEY, n INTEGER, total REAL, total_sq REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS rt_bin_totals (rt_column TEXT, bin INTEGER, count INTEGER, PRIMARY KEY (rt_column, bin))")
+    return conn
+
+
+def scan_results(results_path: str):
+    """
+    Yields (name, mtime_ns, size, PID) for every results#.csv file in
+    results_path, without holding the whole listing in memory.
+    results_path: str representing the full path to the results folder
+    """
+    with os.scandir(results_path) as entries:
+        for entry in entries:
+            match = results_pattern.fullmatch(entry.name)
+            if match:
+                stat = entry.stat()
+                yield entry.name, stat.st_mtime_ns, stat.st_size, int(match.group(1))
+
+
+def read_batch(results_path: str, names: list):
+    """
+    Reads the results files called names and returns their trials as flat
+    lists: the index of the file in names, the stimulus, whether the answer
+    was correct, and the value of each RT column (None where missing).
+    results_path: str representing the full path to the results folder
+    names: list of results file names
+    """
+    file_index = []
+    stimuli = []
+    correct = []
+    rts = {}
+    for k, name in enumerate(names):
+        try:
+            with open(os.path.join(results_path, name), 'r', newline = '') as file:
+                rows = list(csv.reader(file))
+        except OSError:
+            continue
+        if not rows:
+            continue
+        header = rows[0]
+        if "audio_files" not in header or "accuracy" not in header:
+            continue
+        stimulus_col = header.index("audio_files")
+        accuracy_col = header.index("accuracy")
+        rt_cols = [(col, column) for col, column in enumerate(header) if column.startswith('rt')]
+        for column in [column for col, column in rt_cols if column not in rts]:
+            rts[column] = [None] * len(file_index)
+        for row in rows[1:]:
+            if len(row) != len(header):
+                continue
+            file_index.append(k)
+            stimuli.append(row[stimulus_col])
+            correct.append(row[accuracy_col] == 'CORRECT')
+            for column in rts:
+                rts[column].append(None)
+            for col, column in rt_cols:
+                if row[col] != '':
+                    rts[column][-1] = float(row[col])
+    return file_index, stimuli, correct, rts
+
+
+def reduce_batch(names: list, file_index: list, stimuli: list, correct: list, rts: dict):
+    """
+    Reduces the trials of a batch (see read_batch) to the rows of the cache
+    tables, with numpy. Returns the rows of files (without the stat columns),
+    stimuli, rt_stats and rt_bins.
+    """
+    n_files = len(names)
+    file_index = np.asarray(file_index, dtype = np.int64)
+    correct = np.asarray(correct, dtype = np.int64)
+    n_trials = np.bincount(file_index, minlength = n_files)
+    n_correct = np.bincount(file_index, weights = correct, minlength = n_files).astype(np.int64)
+    file_rows = [(int(n_trials[k]), int(n_correct[k])) for k in range(n_files)]
+
+    stimulus_rows = []
+    if len(file_index):
+        stimulus_names, stimulus_index = np.unique(np.asarray(stimuli), return_inverse = True)
+        keys = file_index * len(stimulus_names) + stimulus_index
+        unique_keys, inverse, counts = np.unique(keys, return_inverse = True, return_counts = True)
+        correct_counts = np.bincount(inverse, weights = correct).astype(np.int64)
+        for key, count, n_right in zip(unique_keys, counts, correct_counts):
+            stimulus_rows.append((names[key // len(stimulus_names)], str(stimulus_names[key % len(stimulus_names)]), int(count), int(n_right)))
+
+    stats_rows = []
+    bin_rows = []
+    for column, values in rts.items():
+        values = np.array([np.nan if value is None else value for value in values], dtype = np.float64)
+        present = ~np.isnan(values)
+        files = file_index[present]
+        values = values[present]
+        if not len(values):
+            continue
+        n = np.bincount(files, minlength = n_files)
+        total = np.bincount(files, weights = values, minlength = n_files)
+        total_sq = np.bincount(files, weights = values * values, minlength = n_files)
+        for k in np.flatnonzero(n):
+            stats_rows.append((names[k], column, int(n[k]), float(total[k]), float(total_sq[k])))
+        bins = np.clip(((values - rt_min_ms) // bin_ms).astype(np.int64), 0, n_bins - 1)
+        unique_keys, counts = np.unique(files * n_bins + bins, return_counts = True)
+        for key, count in zip(unique_keys, counts):
+            bin_rows.append((names[key // n_bins], column, int(key % n_bins), int(count)))
+    return file_rows, stimulus_rows, stats_rows, bin_rows
+
+
+# running totals over all files, kept up to date as files are added and
+# dropped, so the summary never has to add up the counts of every file
+totals_sql = {
+    "stimuli": """INSERT INTO stimulus_totals SELECT stimulus, {sign} * SUM(n_trials), {sign} * SUM(n_correct)
+                  FROM stimuli WHERE name IN (SELECT name FROM {names}) GROUP BY stimulus
+                  ON CONFLICT (stimulus) DO UPDATE SET n_trials = n_trials + excluded.n_trials,
+                                                       n_correct = n_correct + excluded.n_correct""",
+    "rt_stats": """INSERT INTO rt_totals SELECT rt_column, {sign} * SUM(n), {sign} * SUM(total), {sign} * SUM(total_sq)
+                   FROM rt_stats WHERE name IN (SELECT name FROM {names}) GROUP BY rt_column
+                   ON CONFLICT (rt_column) DO UPDATE SET n = n + excluded.n, total = total + excluded.total,
+                                                         total_sq = total_sq + excluded.total_sq""",
+    "rt_bins": """INSERT INTO rt_bin_totals SELECT rt_column, bin, {sign} * SUM(count)
+                  FROM rt_bins WHERE name IN (SELECT name FROM {names}) GROUP BY rt_column, bin
+                  ON CONFLICT (rt_column, bin) DO UPDATE SET count = count + excluded.count""",
+}
+
+
+def update_totals(conn: sqlite3.Connection, names: str, sign: int):
+    """
+    Adds (sign 1) or takes away (sign -1) the counts of the files listed in
+    the table called names from the running totals.
+    """
+    for sql in totals_sql.values():
+        conn.execute(sql.format(sign = sign, names = names))
+
+
+def update_cache(results_path: str, conn: sqlite3.Connection):
+    """
+    Brings the summary cache up to date with the results files in
+    results_path: files that are new or whose modification time or size
+    changed are read in batches, and files that are gone are dropped.
+    Returns the number of files read.
+    results_path: str representing the full path to the results folder
+    conn: sqlite3.Connection from open_cache
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS scan (name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, PID INTEGER)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS stale (name TEXT PRIMARY KEY)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch (name TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM scan")
+    conn.execute("DELETE FROM stale")
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO scan VALUES (?, ?, ?, ?)", scan_results(results_path))
+    conn.execute("COMMIT")
+
+    # list the files to read first, since the files table changes as they are read
+    conn.execute("DROP TABLE IF EXISTS todo")
+    conn.execute("""CREATE TEMP TABLE todo AS SELECT s.name, s.mtime_ns, s.size, s.PID FROM scan s LEFT JOIN files f ON f.name = s.name
+                    WHERE f.name IS NULL OR f.mtime_ns != s.mtime_ns OR f.size != s.size""")
+    # drop the counts of files that are gone or changed
+    conn.execute("BEGIN")
+    conn.execute("INSERT INTO stale SELECT name FROM files WHERE name NOT IN (SELECT name FROM scan)")
+    conn.execute("INSERT INTO stale SELECT t.name FROM todo t JOIN files f ON f.name = t.name")
+    update_totals(conn, "stale", -1)
+    for table in ("files", "stimuli", "rt_stats", "rt_bins"):
+        conn.execute("DELETE FROM {} WHERE name IN (SELECT name FROM stale)".format(table))
+    conn.execute("COMMIT")
+
+    n_read = 0
+    while True:
+        batch = conn.execute("SELECT name, mtime_ns, size, PID FROM todo WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                             (n_read, batch_size)).fetchall()
+        if not batch:
+            break
+        names = [row[0] for row in batch]
+        file_rows, stimulus_rows, stats_rows, bin_rows = reduce_batch(names, *read_batch(results_path, names))
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                         (row[:4] + counts for row, counts in zip(batch, file_rows)))
+        conn.executemany("INSERT INTO stimuli VALUES (?, ?, ?, ?)", stimulus_rows)
+        conn.executemany("INSERT INTO rt_stats VALUES (?, ?, ?, ?, ?)", stats_rows)
+        conn.executemany("INSERT INTO rt_bins VALUES (?, ?, ?, ?)", bin_rows)
+        conn.execute("DELETE FROM batch")
+        conn.executemany("INSERT INTO batch VALUES (?)", ((name,) for name in names))
+        update_totals(conn, "batch", 1)
+        conn.execute("COMMIT")
+        n_read += len(batch)
+    return n_read
+
+
+def stimulus_accuracy(conn: sqlite3.Connection):
+    """returns (stimulus, trials, correct, accuracy) for every stimulus."""
+    return [(stimulus, n, correct, correct / n) for stimulus, n, correct in
+            conn.execute("SELECT stimulus, n_trials, n_correct FROM stimulus_totals WHERE n_trials > 0 ORDER BY stimulus")]
+
+
+def participant_accuracy(conn: sqlite3.Connection):
+    """yields (PID, trials, correct, accuracy) for every participant, in PID order."""
+    for PID, n, correct in conn.execute("SELECT PID, n_trials, n_correct FROM files WHERE n_trials > 0 ORDER BY PID"):
+        yield PID, n, correct, correct / n
+
+
+def rt_distribution(conn: sqlite3.Connection, rt_column: str, quantiles: tuple = (0.05, 0.25, 0.5, 0.75, 0.95)):
+    """
+    Returns a dict with the count, mean, standard deviation and quantiles of
+    an RT column. Quantiles are read off the 10 ms histogram.
+    rt_column: str representing the name of the RT column
+    quantiles: tuple of float quantiles to report
+    """
+    n, total, total_sq = conn.execute("SELECT n, total, total_sq FROM rt_totals WHERE rt_column = ?", (rt_column,)).fetchone()
+    histogram = np.zeros(n_bins, dtype = np.int64)
+    rows = np.array(conn.execute("SELECT bin, count FROM rt_bin_totals WHERE rt_column = ?", (rt_column,)).fetchall(), dtype = np.int64)
+    if len(rows):
+        histogram[rows[:, 0]] = rows[:, 1]
+    cumulative = np.cumsum(histogram)
+    summary = {"n": n, "mean": total / n, "sd": float(np.sqrt(max(0.0, total_sq / n - (total / n) ** 2)))}
+    for quantile in quantiles:
+        # the middle of the bin that holds the quantile
+        k = int(np.searchsorted(cumulative, quantile * cumulative[-1]))
+        summary["p" + str(int(quantile * 100))] = rt_min_ms + (k + 0.5) * bin_ms
+    return summary
+
+
+def rt_columns(conn: sqlite3.Connection):
+    """returns the names of the RT columns in the cache."""
+    return [row[0] for row in conn.execute("SELECT rt_column FROM rt_totals WHERE n > 0 ORDER BY rt_column")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "summarize the results#.csv files in a results folder")
+    parser.add_argument("results_path", help = "results folder, e.g. demo_results")
+    parser.add_argument("--participants", default = None, help = "write the accuracy of every participant to this .csv file")
+    args = parser.parse_args()
+    results_path = os.path.abspath(args.results_path)
+
+    conn = open_cache(results_path)
+    n_read = update_cache(results_path, conn)
+    n_files, n_trials, n_correct = conn.execute("SELECT COUNT(*), SUM(n_trials), SUM(n_correct) FROM files").fetchone()
+    print("{} sessions ({} read now), {} trials, accuracy {:.3f}".format(n_files, n_read, n_trials or 0, (n_correct or 0) / max(1, n_trials or 0)))
+
+    print("\n{:<20} {:>10} {:>10} {:>10}".format("stimulus", "trials", "correct", "accuracy"))
+    for stimulus, n, correct, accuracy in stimulus_accuracy(conn):
+        print("{:<20} {:>10} {:>10} {:>10.3f}".format(stimulus, n, correct, accuracy))
+
+    columns = rt_columns(conn)
+    if columns:
+        print("\n{:<18} {:>10} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}".format("rt column", "n", "mean", "sd", "p5", "p25", "p50", "p75", "p95"))
+    for column in columns:
+        summary = rt_distribution(conn, column)
+        print("{:<18} {:>10} {:>9.1f} {:>9.1f} {:>9.0f} {:>9.0f} {:>9.0f} {:>9.0f} {:>9.0f}".format(
+              column, summary["n"], summary["mean"], summary["sd"], summary["p5"], summary["p25"], summary["p50"], summary["p75"], summary["p95"]))
+
+    if args.participants:
+        with open(args.participants, 'w', newline = '') as file:
+            writer = csv.writer(file)
+            writer.writerow(["PID", "trials", "correct", "accuracy"])
+            writer.writerows(participant_accuracy(conn))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Word and syllable segmentation index for statistical_learning_demo.py.
+
+Every stimulus in the stimulus manifest is analyzed offline: the RMS envelope
+is computed in short frames, the stretches of sound between silences are the
+words, and the dips of the envelope inside a word are the syllable
+boundaries. Each test file holds two words separated by a pause, so it gets
+two words. The training stream has no pauses between words (that is the
+point of the experiment), so its words are the stretches of continuous
+speech and only its syllables are useful.
+
+The result is written to segments.json in the stimulus folder, with times in
+milliseconds from the start of each file and the hash of the file it was
+computed from. Files whose hash has not changed are not analyzed again. The
+demo only reads this index, so it never analyzes audio during a session.
+Needs numpy. Build it after the manifest:
+    python segment_index.py demo_audio
+"""
+import os
+import json
+import wave
+import argparse
+import stimulus_manifest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# name of the segment index file in the stimulus folder
+segments_name = 'segments.json'
+
+# numpy sample types of .wav sample widths in bytes. 8 bit samples are unsigned.
+sample_types = {1: 'u1', 2: '<i2', 4: '<i4'}
+
+
+def index_path(audio_path: str):
+    """returns the full path to the segment index of the stimulus folder audio_path."""
+    return os.path.join(audio_path, segments_name)
+
+
+def decode_samples(audio_file: str):
+    """
+    Returns the samples of a compressed (.flac or .ogg) file as a mono float
+    array, and its sample rate. The file is decoded by the pygame mixer at its
+    own sample rate and channel count.
+    audio_file: str representing the full path to the file
+    """
+    import pygame
+    audio_format = stimulus_manifest.audio_formats[os.path.splitext(audio_file)[1].lower()]
+    frequency, sampwidth, channels, frames = stimulus_manifest.header_readers[audio_format](audio_file)
+    if pygame.mixer.get_init() != (frequency, -16, channels):
+        pygame.mixer.quit()
+        pygame.mixer.init(frequency, -16, channels)
+    samples = np.frombuffer(pygame.mixer.Sound(audio_file).get_raw(), dtype = '<i2').astype(np.float32)
+    return samples.reshape(-1, channels).mean(axis = 1), frequency
+
+
+def read_samples(audio_file: str):
+    """
+    Returns the samples of a stimulus as a mono float array, and its sample
+    rate. Channels are averaged.
+    audio_file: str representing the full path to a stimulus file
+    """
+    if not audio_file.lower().endswith('.wav'):
+        return decode_samples(audio_file)
+    with wave.open(audio_file, 'rb') as wav:
+        frequency = wav.getframerate()
+        channels = wav.getnchannels()
+        sampwidth = wav.getsampwidth()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype = sample_types[sampwidth]).astype(np.float32)
+    if sampwidth == 1:
+        samples -= 128
+    return samples.reshape(-1, channels).mean(axis = 1), frequency
+
+
+def envelope_db(samples, frequency: int, hop_ms: int = 5, smooth: int = 5):
+    """
+    Returns the RMS envelope of samples in frames of hop_ms milliseconds, in
+    dB below its loudest frame, smoothed by a moving average over smooth frames.
+    samples: mono float array from read_samples
+    frequency: int representing the sample rate
+    hop_ms: int representing the frame length in milliseconds
+    smooth: int representing the length of the moving average in frames
+    """
+    hop = int(frequency * hop_ms / 1000)
+    n_frames = len(samples) // hop
+    rms = np.sqrt(np.mean(np.square(samples[:n_frames * hop].reshape(n_frames, hop)), axis = 1))
+    rms = np.convolve(rms, np.ones(smooth) / smooth, mode = 'same')
+    return 20 * np.log10(rms / (rms.max() + 1e-12) + 1e-9)
+
+
+def sound_regions(db, hop_ms: int, threshold_db: float = -35, min_gap_ms: int = 150):
+    """
+    Returns the (start, end) frames of the stretches of db above threshold_db.
+    Stretches separated by less than min_gap_ms are joined.
+    db: envelope from envelope_db
+    hop_ms: int representing the frame length in milliseconds
+    threshold_db: float representing the level that counts as sound
+    min_gap_ms: int representing the shortest silence between two stretches
+    """
+    edges = np.diff(np.concatenate(([0], (db > threshold_db).astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return starts, ends
+    # keep a start only if the silence before it is long enough, and the end before it with it
+    keep = np.concatenate(([True], (starts[1:] - ends[:-1]) * hop_ms >= min_gap_ms))
+    return starts[keep], np.concatenate((ends[:-1][keep[1:]], ends[-1:]))
+
+
+def syllable_boundaries(db, start: int, end: int, hop_ms: int, min_ms: int = 120, min_depth_db: float = 6, window_ms: int = 100):
+    """
+    Returns the frames of the syllable boundaries in db[start:end]. These are
+    the local minima of the envelope that lie at least min_depth_db below the
+    highest point within window_ms on both sides. Of minima closer than
+    min_ms to each other, or to the start or end, only the deepest is kept.
+    db: envelope from envelope_db
+    start, end: int representing the frames of a word from sound_regions
+    hop_ms: int representing the frame length in milliseconds
+    min_ms: int representing the shortest syllable in milliseconds
+    min_depth_db: float representing how deep a dip must be
+    window_ms: int representing how far to look for the peaks around a dip
+    """
+    word = db[start:end]
+    minima = np.flatnonzero((word[1:-1] < word[:-2]) & (word[1:-1] <= word[2:])) + 1
+    window = max(1, window_ms // hop_ms)
+    # windows[k] holds word[k - window:k], so the peaks left and right of
+    # minimum m are in windows[m] and windows[m + window + 1]
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(word, window, constant_values = -np.inf), window)
+    depth = np.minimum(windows[minima].max(axis = 1), windows[minima + window + 1].max(axis = 1)) - word[minima]
+    inside = (minima * hop_ms >= min_ms) & ((len(word) - minima) * hop_ms >= min_ms)
+    candidates = minima[(depth >= min_depth_db) & inside]
+    depth = depth[(depth >= min_depth_db) & inside]
+
+    boundaries = []
+    for k in np.argsort(-depth, kind = 'stable'):
+        if all(abs(candidates[k] - other) * hop_ms >= min_ms for other in boundaries):
+            boundaries.append(candidates[k])
+    return sorted(int(start + frame) for frame in boundaries)
+
+
+def segment_file(audio_file: str, hop_ms: int = 5):
+    """
+    Returns the words and syllables of a stimulus as lists of [start, end]
+    times in milliseconds.
+    audio_file: str representing the full path to a .wav file
+    hop_ms: int representing the frame length of the analysis in milliseconds
+    """
+    samples, frequency = read_samples(audio_file)
+    db = envelope_db(samples, frequency, hop_ms)
+    words = []
+    syllables = []
+    for start, end in zip(*sound_regions(db, hop_ms)):
+        words.append([int(start) * hop_ms, int(end) * hop_ms])
+        edges = [int(start)] + syllable_boundaries(db, start, end, hop_ms) + [int(end)]
+        syllables += [[a * hop_ms, b * hop_ms] for a, b in zip(edges[:-1], edges[1:])]
+    return {"words": words, "syllables": syllables}
+
+
+def load_index(audio_path: str):
+    """
+    Returns the segment index of the stimulus folder audio_path, a dict
+    mapping file names to their entries, or an empty dict if there is none.
+    audio_path: str representing the full path to the stimulus folder
+    """
+    try:
+        with open(index_path(audio_path), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def build_index(audio_path: str, manifest: dict):
+    """
+    Segments every stimulus in the manifest whose hash is not in the index
+    yet and returns the updated index. Entries of files that are no longer in
+    the manifest are dropped.
+    audio_path: str representing the full path to the stimulus folder
+    manifest: dict from stimulus_manifest.load_manifest
+    """
+    if np is None:
+        raise ImportError("segment_index.py needs numpy (pip install numpy)")
+    old = load_index(audio_path)
+    index = {}
+    for name, entry in sorted(manifest["files"].items()):
+        if name in old and old[name]["sha256"] == entry["sha256"]:
+            index[name] = old[name]
+            continue
+        index[name] = {"sha256": entry["sha256"]}
+        index[name].update(segment_file(os.path.join(audio_path, name)))
+    return index
+
+
+def save_index(audio_path: str, index: dict):
+    """writes the segment index to the stimulus folder audio_path, one file per line."""
+    lines = ['{}: {}'.format(json.dumps(name), json.dumps(entry)) for name, entry in index.items()]
+    with open(index_path(audio_path), 'w') as file:
+        file.write('{\n' + ',\n'.join(lines) + '\n}\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "build the word and syllable segment index of a stimulus folder")
+    parser.add_argument("audio_path", help = "stimulus folder with a manifest, e.g. demo_audio")
+    args = parser.parse_args()
+    audio_path = os.path.abspath(args.audio_path)
+    manifest = stimulus_manifest.load_manifest(audio_path)
+    if manifest is None:
+        parser.error("no manifest in " + audio_path + ", run stimulus_manifest.py first")
+    index = build_index(audio_path, manifest)
+    save_index(audio_path, index)
+    for name, entry in index.items():
+        print("{:<20} {} words, {} syllables".format(name, len(entry["words"]), len(entry["syllables"])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Fast forward replays of recorded sessions of statistical_learning_demo.py.
+
+A replay runs the whole experiment again (instructions, training, every test
+trial and the results screen) headless on a virtual clock (see
+virtual_clock.py), pressing the keys of a recorded session at the times they
+were pressed. Waits and sounds take no real time, so a session replays
+hundreds of times faster than it ran. Replays write their results to their
+own results folder, and each one is compared to the original results#.csv:
+the trial order, responses, accuracy and rt_flip_ms must be the same, and rt
+the same within rt_tolerance_ms (pygame ticks are whole milliseconds, taken
+just after the screen flip). Columns that depend on the sound card and the
+machine (the audio based rts and the latencies) are not compared.
+
+The key presses come from the keys record of the trial journal of a session.
+Sessions without one (older sessions, or sessions recovered after a crash)
+are replayed from their results#.csv alone: each response is pressed at its
+rt_flip_ms (or rt) and every other key as soon as it is accepted.
+
+    python session_replay.py demo_results
+    python session_replay.py demo_results --pid 12 --pid 13 --out replay_results
+"""
+import os
+import re
+import csv
+import sys
+import time
+import argparse
+import tempfile
+from collections import deque
+import pygame
+import trial_journal
+import results_store
+import virtual_clock
+
+# columns that must be the same in a replay
+exact_columns = ("trial_num", "audio_files", "responses", "accuracy")
+# columns that must be the same up to rounding
+ms_columns = ("rt_flip_ms",)
+# largest difference in rt between a replay and the original
+rt_tolerance_ms = 2
+
+# names of the results files
+results_pattern = re.compile(r'results(\d+)\.csv')
+
+
+def read_results(csv_path: str):
+    """returns the rows of a results#.csv file as a list of dicts."""
+    with open(csv_path, 'r', newline = '') as file:
+        return list(csv.DictReader(file))
+
+
+def journal_keys(results_path: str):
+    """
+    Returns a dict mapping the PID of every finished session in the journal
+    subfolder of results_path to the key log of its journal, for the
+    journals that have one.
+    results_path: str representing the full path to the results folder
+    """
+    folder = os.path.join(results_path, trial_journal.journal_folder)
+    if not os.path.isdir(folder):
+        return {}
+    keys = {}
+    for name in sorted(os.listdir(folder)):
+        records = trial_journal.read_journal(os.path.join(folder, name))
+        PID = next((record["PID"] for record in records if record["type"] == "end"), None)
+        key_log = next((record["keys"] for record in records if record["type"] == "keys"), None)
+        if PID is not None and key_log is not None:
+            keys[PID] = key_log
+    return keys
+
+
+def results_key_log(rows: list):
+    """
+    Returns the key log of the responses of a results#.csv file: each
+    response pressed on the response screen at its rt_flip_ms, or its rt for
+    files without that column.
+    rows: list of dicts from read_results
+    """
+    key_log = []
+    for row in rows:
+        key = pygame.K_LSHIFT if row["responses"] == '1' else pygame.K_RSHIFT
+        ms = row.get("rt_flip_ms") or row.get("rt")
+        key_log.append(("response", key, float(ms) if ms else 0))
+    return key_log
+
+
+def screen_kind(name: str):
+    """returns the name of a screen without its number or score, e.g. 'results' for 'results 3/8'."""
+    return (name or '').split(' ')[0]
+
+
+class ReplayPress:
+    """
+    Press function of a VirtualClock that presses the keys of a key log. On
+    each screen the logged keys of that kind of screen are pressed in order,
+    at their time from the onset of the screen. A wait with no logged key left
+    is ended with the first accepted key straight away, or times out if any
+    key is accepted.
+    key_log: list of (screen name, key, ms since the screen was shown)
+    demo: the statistical_learning_demo module running the session
+    """
+
+    def __init__(self, key_log: list, demo):
+        self.demo = demo
+        self.keys = {}
+        for screen, key, ms in key_log:
+            self.keys.setdefault(screen_kind(screen), deque()).append((key, ms or 0))
+
+    def __call__(self, keys: tuple, any_key: bool):
+        logged = self.keys.get(screen_kind(self.demo.exp_globals["current_screen"]))
+        while logged:
+            key, ms = logged.popleft()
+            if any_key or key in keys:
+                shown_ms = (self.demo.now_ns() - self.demo.timing["flip_ns"]) / 1e6
+                return ms - shown_ms, key
+        if any_key:
+            return None
+        return 0, keys[0]
+
+
+def compare(original: list, replay: list, tolerance: float = rt_tolerance_ms):
+    """
+    Compares the rows of a replay to the rows of the original results#.csv
+    and returns a list of differences (empty if they match).
+    original: list of dicts from read_results
+    replay: list of dicts from read_results
+    tolerance: float representing the largest difference in rt
+    """
+    if len(original) != len(replay):
+        return ["{} trials instead of {}".format(len(replay), len(original))]
+    problems = []
+    for row, new in zip(original, replay):
+        trial = "trial " + row.get("trial_num", "?")
+        for column in exact_columns:
+            if column in row and row[column] != new[column]:
+                problems.append("{} {}: {} instead of {}".format(trial, column, new[column], row[column]))
+        for column in ms_columns:
+            if row.get(column) and abs(float(new[column]) - float(row[column])) > 1e-6:
+                problems.append("{} {}: {} instead of {}".format(trial, column, new[column], row[column]))
+        if row.get("rt") and abs(float(new["rt"]) - float(row["rt"])) > tolerance:
+            problems.append("{} rt: {} instead of {}".format(trial, new["rt"], row["rt"]))
+    return problems
+
+
+def replay_session(demo, rows: list, key_log: list):
+    """
+    Replays one session of the configured (headless) demo on a virtual clock
+    and returns the rows of its results and the virtual length of the session
+    in milliseconds.
+    demo: the statistical_learning_demo module, configured and initialized
+    rows: list of dicts of the original results#.csv, for the trial order
+    key_log: list of (screen name, key, ms since the screen was shown)
+    """
+    demo.reset_session()
+    demo.session_config["audio_files"] = [row["audio_files"] for row in rows]
+    clock = virtual_clock.VirtualClock(ReplayPress(key_log, demo))
+    demo.exp_globals["events"] = clock
+    demo.run_session()
+    results_path = demo.session_config["results_path"]
+    PID = results_store.highest_csv_pid(results_path)
+    return read_results(os.path.join(results_path, 'results' + str(PID) + ".csv")), clock.now_ns() / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "replay recorded sessions on a virtual clock and check them against their results")
+    parser.add_argument("results_path", help = "results folder of the recorded sessions, e.g. demo_results")
+    parser.add_argument("--pid", type = int, action = "append", default = [], help = "PID to replay (repeatable, default: all)")
+    parser.add_argument("--out", default = None, help = "results folder of the replays (default: a new temporary folder)")
+    parser.add_argument("--rt-tolerance", type = float, default = rt_tolerance_ms, help = "largest difference in rt, in ms")
+    args = parser.parse_args()
+    results_path = os.path.abspath(args.results_path)
+    out_path = os.path.abspath(args.out) if args.out else tempfile.mkdtemp(prefix = 'replay-')
+    os.makedirs(out_path, exist_ok = True)
+
+    recorded = {}
+    for name in os.listdir(results_path):
+        match = results_pattern.fullmatch(name)
+        if match and (not args.pid or int(match.group(1)) in args.pid):
+            recorded[int(match.group(1))] = os.path.join(results_path, name)
+    keys = journal_keys(results_path)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import statistical_learning_demo as demo
+    demo.configure_session(results_path = out_path, headless = True, randomize = False)
+    demo.init_pygame(demo.exp_globals["screen_size"], demo.exp_globals["FPS"])
+
+    n_match = 0
+    session_ms = 0
+    start_time = time.perf_counter()
+    for PID in sorted(recorded):
+        rows = read_results(recorded[PID])
+        unknown = sorted(set(row["audio_files"] for row in rows) - set(demo.answer_key))
+        if unknown:
+            print("results{}.csv: not in the stimulus manifest: {}".format(PID, ", ".join(unknown)))
+            continue
+        replay, length_ms = replay_session(demo, rows, keys.get(PID) or results_key_log(rows))
+        session_ms += length_ms
+        problems = compare(rows, replay, args.rt_tolerance)
+        if problems:
+            print("results{}.csv ({}):\n  {}".format(PID, "journal keys" if PID in keys else "csv keys", "\n  ".join(problems)))
+        else:
+            n_match += 1
+    elapsed = time.perf_counter() - start_time
+    demo.close_decoder()
+    pygame.quit()
+
+    print("{} of {} sessions match; {:.1f} s of sessions replayed in {:.2f} s ({:.0f} times real time) to {}".format(
+          n_match, len(recorded), session_ms / 1000, elapsed, session_ms / 1000 / max(elapsed, 1e-9), out_path))
+    raise SystemExit(0 if n_match == len(recorded) else 1)
+
+
+if __name__ == '__main__':
+    main()
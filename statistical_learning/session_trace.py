@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Session timeline tracing for statistical_learning_demo.py.
+
+A SessionTrace records timestamped events of the phases of a session (enter
+and exit of e.g. an ISI or a trial, and instants such as the audio onset or a
+screen flip) into a ring buffer that is allocated once. Recording an event
+only writes a few numbers into preallocated arrays, so it can be called from
+the trial flow at any time, from any thread. When the buffer is full the
+oldest events are overwritten.
+
+A trace is exported as a .json file in the Chrome trace event format, which
+can be opened in chrome://tracing or https://ui.perfetto.dev. Times come from
+the clock the trace is given, which for the demo is the clock of the session
+(see virtual_clock.py), the same one it uses for its RT columns.
+"""
+import os
+import json
+import time
+import itertools
+import threading
+from array import array
+
+# kinds of events, and their phase in the Chrome trace event format
+ENTER = 0
+EXIT = 1
+INSTANT = 2
+chrome_phases = {ENTER: 'B', EXIT: 'E', INSTANT: 'i'}
+
+
+class SessionTrace:
+    """
+    Ring buffer of trace events. Phases are named by strings, which are given
+    a number the first time they are used.
+    capacity: int representing the most events kept
+    clock: callable returning the time now in nanoseconds
+    """
+
+    def __init__(self, capacity: int = 8192, clock = time.perf_counter_ns):
+        self.capacity = capacity
+        self.clock = clock
+        self.names = []
+        self.ids = {}
+        # held while a new phase is numbered, since threads may add phases at once
+        self.lock = threading.Lock()
+        self.time_ns = array('q', [0]) * capacity
+        self.phase = array('H', [0]) * capacity
+        self.kind = array('B', [0]) * capacity
+        self.arg = array('q', [0]) * capacity
+        self.thread = array('q', [0]) * capacity
+        # next() on a count is atomic, so threads never get the same slot
+        self.counter = itertools.count()
+
+    def phase_id(self, name: str):
+        """returns the number of the phase called name, adding it if it is new."""
+        with self.lock:
+            if name not in self.ids:
+                self.names.append(name)
+                self.ids[name] = len(self.names) - 1
+            return self.ids[name]
+
+    def record(self, name: str, kind: int, arg: int = 0, time_ns: int = None):
+        """
+        Records one event. time_ns defaults to now.
+        name: str representing the phase
+        kind: int, one of ENTER, EXIT or INSTANT
+        arg: int stored with the event, e.g. the trial number
+        time_ns: int representing the time of the event on the clock of the trace
+        """
+        slot = next(self.counter) % self.capacity
+        self.time_ns[slot] = self.clock() if time_ns is None else time_ns
+        self.phase[slot] = self.ids[name] if name in self.ids else self.phase_id(name)
+        self.kind[slot] = kind
+        self.arg[slot] = arg
+        self.thread[slot] = threading.get_ident() & 0x7fffffff
+
+    def enter(self, name: str, arg: int = 0):
+        self.record(name, ENTER, arg)
+
+    def exit(self, name: str, arg: int = 0):
+        self.record(name, EXIT, arg)
+
+    def mark(self, name: str, arg: int = 0, time_ns: int = None):
+        self.record(name, INSTANT, arg, time_ns)
+
+    def clear(self):
+        """drops every event. Call between sessions."""
+        self.counter = itertools.count()
+
+    def events(self):
+        """
+        Returns the kept events, oldest first, as (time_ns, name, kind, arg,
+        thread) tuples. Only call while no events are being recorded.
+        """
+        count = next(self.counter)
+        self.counter = itertools.count(count)
+        first = max(0, count - self.capacity)
+        return [(self.time_ns[k % self.capacity], self.names[self.phase[k % self.capacity]],
+                 self.kind[k % self.capacity], self.arg[k % self.capacity], self.thread[k % self.capacity])
+                for k in range(first, count)]
+
+    def export_chrome(self, trace_path: str, metadata: dict = None):
+        """
+        Writes the kept events to trace_path in the Chrome trace event format.
+        Times are in microseconds from the first event.
+        trace_path: str representing the full path of the .json file to write
+        metadata: dict written with the trace, e.g. the session settings
+        """
+        events = self.events()
+        start_ns = min((event[0] for event in events), default = 0)
+        trace_events = []
+        for time_ns, name, kind, arg, thread in events:
+            event = {"name": name, "ph": chrome_phases[kind], "ts": (time_ns - start_ns) / 1000,
+                     "pid": os.getpid(), "tid": thread, "args": {"arg": arg}}
+            if kind == INSTANT:
+                event["s"] = "t"
+            trace_events.append(event)
+        os.makedirs(os.path.dirname(trace_path), exist_ok = True)
+        with open(trace_path, 'w') as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms",
+                       "otherData": dict(metadata or {}, start_ns = start_ns)}, file)
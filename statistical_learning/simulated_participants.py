@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Simulated participants for headless runs of statistical_learning_demo.py.
+
+A simulated participant answers the forced choice test trials. Each one has a
+choose method that takes the name of the test audio file (e.g. 'Q1.wav') and
+returns 1 or 2 for the first or second sound, the same as pressing LEFT SHIFT
+or RIGHT SHIFT in the real experiment.
+
+The transitional probability learner needs a syllable transcription of the
+training stream and of both words in each test item. The transcription is a
+.json file of the form:
+
+{"training": "pa bi ku ti bu do ...",
+ "test_items": {"Q1.wav": ["pa bi ku", "ku ti bu"], ...}}
+"""
+import json
+import random
+from collections import Counter
+
+
+class RandomLearner:
+    """guesses sound 1 or sound 2 with equal probability."""
+
+    def __init__(self, seed: int = None):
+        self.rng = random.Random(seed)
+
+    def choose(self, audio_file: str):
+        return self.rng.choice((1, 2))
+
+
+class OracleLearner:
+    """
+    knows the answer key and answers correctly with probability accuracy.
+    answer_key: dict mapping test audio file names to the correct sound (1 or 2)
+    accuracy: float representing the probability of a correct answer
+    seed: int used to seed the random number generator
+    """
+
+    def __init__(self, answer_key: dict, accuracy: float = 0.75, seed: int = None):
+        self.answer_key = answer_key
+        self.accuracy = accuracy
+        self.rng = random.Random(seed)
+
+    def choose(self, audio_file: str):
+        correct = self.answer_key[audio_file]
+        if self.rng.random() < self.accuracy:
+            return correct
+        return 3 - correct
+
+
+class TPLearner:
+    """
+    learns the transitional probabilities between syllables of the training
+    stream, P(B|A) = count(AB) / count(A), and picks the test word whose
+    syllable transitions are more probable on average. noise is the standard
+    deviation of gaussian noise added to each word score, which lowers the
+    accuracy of the learner. Ties are broken at random.
+    training: str or list of syllables of the training stream
+    test_items: dict mapping test audio file names to the syllables of
+    sound 1 and sound 2, each a string or list of syllables
+    noise: float representing the noise added to each word score
+    seed: int used to seed the random number generator
+    """
+
+    def __init__(self, training, test_items: dict, noise: float = 0.0, seed: int = None):
+        syllables = training.split() if isinstance(training, str) else list(training)
+        self.unigrams = Counter(syllables[:-1])
+        self.bigrams = Counter(zip(syllables[:-1], syllables[1:]))
+        self.test_items = test_items
+        self.noise = noise
+        self.rng = random.Random(seed)
+
+    def transitional_probability(self, first: str, second: str):
+        if self.unigrams[first] == 0:
+            return 0.0
+        return self.bigrams[(first, second)] / self.unigrams[first]
+
+    def word_score(self, word):
+        syllables = word.split() if isinstance(word, str) else list(word)
+        transitions = list(zip(syllables[:-1], syllables[1:]))
+        if not transitions:
+            return 0.0
+        return sum(self.transitional_probability(a, b) for a, b in transitions) / len(transitions)
+
+    def choose(self, audio_file: str):
+        word1, word2 = self.test_items[audio_file]
+        score1 = self.word_score(word1) + self.rng.gauss(0, self.noise)
+        score2 = self.word_score(word2) + self.rng.gauss(0, self.noise)
+        if score1 == score2:
+            return self.rng.choice((1, 2))
+        return 1 if score1 > score2 else 2
+
+
+def load_transcription(transcription_file: str):
+    """
+    Reads a transcription .json file and returns the training syllables and
+    the test items, ready to be passed to TPLearner.
+    transcription_file: str representing the full path to the .json file
+    """
+    with open(transcription_file, 'r') as file:
+        transcription = json.load(file)
+    return transcription["training"], transcription["test_items"]
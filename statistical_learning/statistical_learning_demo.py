@@ -18,17 +18,50 @@ correct. They must indicate the correct response with the shift keys.
 # import pygame and other required packages
 import pygame
 import os
-import csv
-from tkinter import Tk
+import sys
+import io
+import json
+import time
+import wave
+import threading
 from random import shuffle
-from itertools import zip_longest
+from datetime import datetime
 from collections import OrderedDict
+import results_store
+import trial_journal
+import stimulus_manifest
+import stimulus_decoder
+import session_trace
+import virtual_clock
 
 # set to True or False to debug. Debug will skip training and do 2 test trials
 debug = False
 
 # setting to True will randomize the audio files. False will go in order.
 randomize = True
+
+# setting to True will stream the training file in chunks instead of decoding
+# the whole file before playing it. stream_chunk_ms sets the chunk length.
+stream_training = True
+stream_chunk_ms = 500
+
+# headless runs use the dummy SDL drivers and no Tk, and run on a virtual
+# clock (see virtual_clock.py). Key presses come from the simulated
+# participant in exp_globals["participant"] (a RandomLearner unless one is
+# set, see simulated_participants.py), nothing is played, and waits and sounds
+# take no real time. Setting SL_HEADLESS=1 turns it on by default.
+headless = os.environ.get("SL_HEADLESS") == "1"
+
+# set to the path of a grammar .json file to play every participant their own
+# synthesized training stream instead of TrainingFile.wav (see
+# stream_synthesis.py, which needs numpy). None plays TrainingFile.wav.
+training_grammar = None
+
+# setting to True writes a timeline of every session (see session_trace.py) to
+# the traces subfolder of the results folder. profile_sessions adds a cProfile
+# of each session next to it.
+trace_sessions = True
+profile_sessions = False
 """
 The following lines set up the folder and path depedencies. The program expects
 three subfolders named 'demo_audio', 'demo_results', and 'instructions'.
@@ -38,6 +71,10 @@ folder should contain a file named 'welcome.txt' which contains the main
 instructions for the experiment. The 'demo_results' folder is initially empty
 but will fill up with output in the form of .csv files as more participants
 complete the task.
+
+Nothing is read from disk when the module is imported. configure_session
+resolves the paths (by default next to this module) and finds the test audio
+files, and init_pygame gets the screen size from pygame.
 """
 
 # name of required subfolders
@@ -45,41 +82,41 @@ audio_folder = 'demo_audio'
 results_folder = 'demo_results'
 instructions_folder = 'instructions'
 
-# get current working directory
-cwd = os.path.abspath(os.curdir)
-
-# creates path to audio folder which is currently named demo3_audio
-audio_path = os.path.join(cwd,audio_folder)
-# print directory of parent folder
-audio_dir = os.listdir(audio_path)
-
-# list to hold names of test audio files
-audio_files = []
-# fills the audio_files list with all of the test audio file names.
-for file in audio_dir:
-    # checks audio_dir for sound files beginning with 'Q' (indicating test file)
-    if file.endswith('.wav') and file.startswith('Q'):
-        audio_files.append(file)
-
-audio_files.sort() # sorts the audio files alphabetically
-if randomize: # randomizes order of audio_files items if set to True
-    shuffle(audio_files)
-# print(audio_files)
-num_af = len(audio_files) # count number of test audio_files
+# folder that holds this module, used as the default base path
+module_path = os.path.dirname(os.path.abspath(__file__))
 
-# specify the training audio file full path name
-training_file = os.path.join(audio_path,'TrainingFile.wav')
+# name of the cache folder and file used to speed up later launches
+cache_folder = '.cache'
+cache_name = 'startup_cache.json'
 
-# creates path to welcome.txt which should be a subfolder named instructions
-instruction_file = os.path.join(cwd, instructions_folder, 'welcome.txt')
+# name of the subfolder of the results folder that holds the session timelines
+trace_folder = 'traces'
 
-# creates path to the results folder to be used when writing results
-results_path = os.path.join(cwd,results_folder)
+# name of the word and syllable segment index in the audio folder, built
+# offline by segment_index.py
+segments_name = 'segments.json'
 
-# used to get screen dimensions
-root = Tk()
-screen_width = root.winfo_screenwidth()
-screen_height = root.winfo_screenheight()
+"""
+=== session configuration ===
+filled by configure_session before the experiment runs. The options default
+to the settings at the top of this module.
+"""
+session_config = {"base_path": None, # folder that holds the subfolders
+                  "audio_path": None, # full path to the audio folder
+                  "training_file": None, # full path to TrainingFile.wav
+                  "instruction_file": None, # full path to welcome.txt
+                  "results_path": None, # full path to the results folder
+                  "audio_files": [], # test audio file names in trial order
+                  "manifest": None, # stimulus manifest of the audio folder
+                  "segments": {}, # file name -> word and syllable times (ms)
+                  "debug": debug,
+                  "randomize": randomize,
+                  "stream_training": stream_training,
+                  "headless": headless,
+                  "training_grammar": training_grammar,
+                  "trace": trace_sessions,
+                  "profile": profile_sessions,
+}
 
 """
 === define global pygame program parameters in a dict ===
@@ -87,182 +124,1240 @@ this ensures that they are accessible in each function
 """
 exp_globals = {"bg_color": (180, 180, 180), # bg is light grey
               "text_color": (0, 0, 0), # text is green
-              "screen_size": (screen_width, screen_height), # set screen screenSize
-              "FPS": 60, # frames per second
+              "screen_size": None, # screen size, None uses the display size
+              "FPS": 60, # frames per second, the most screen updates per second
+              "vsync": False, # set to True to request a vsync'd display
+              "clock": None, # pygame clock used to pace screen updates
+              "current_screen": None, # name of the screen on the display
               "font": None, # sets font type
               "screen": None, # placeholder for screen instance
               "screen_rect": None, # placeholder for screen rectangle
               "window_caption": 'Demo 3', # caption for pygame window
+              "participant": None, # simulated participant for headless runs
+              "journal": None, # trial journal of the running session
+              "decoder": None, # background decoder of upcoming stimuli
+              "trace_path": None, # timeline file of the running session
+              "profiler": None, # cProfile of the running session
+              "events": virtual_clock.PygameClock(), # clock and event source, see virtual_clock.py
+}
+# correct sound (1 or 2) of each test audio file, filled from the stimulus
+# manifest by configure_session
+answer_key = {}
+
+"""
+=== stimulus bank ===
+every stimulus is loaded and decoded once by a background thread, starting
+while the instructions are on screen and in the order the stimuli are played,
+so that no trial pays for disk reads or decoding at stimulus onset. stimuli
+can be .wav, .flac or .ogg files; the decoded PCM of compressed files is kept
+in the cache folder. only a window of upcoming stimuli that fits the memory
+budget is decoded ahead, and the window moves on after every trial. when the
+decoded audio would exceed the budget, the least recently used sounds that
+are not upcoming anymore are evicted. upcoming sounds are never evicted.
+"""
+stimulus_bank = {"sounds": OrderedDict(), # path -> decoded pygame.mixer.Sound
+                 "stats": OrderedDict(), # path -> load time and memory info
+                 "resident_bytes": 0, # bytes of decoded audio currently held
+                 "budget": 64 * 1024 * 1024, # memory budget in bytes (64 MB)
+                 "upcoming": [], # full paths of the stimuli still to be played, in order
+                 "lock": threading.Lock(), # shared with the background decoder
 }
-answer_key = {"Q1.wav": 1,
-              "Q2.wav": 2,
-              "Q3.wav": 2,
-              "Q4.wav": 1,
-              "Q5.wav": 1,
-              "Q6.wav": 2,
-              "Q7.wav": 1,
-              "Q8.wav": 2
+
+"""
+=== synthesized training stream ===
+used instead of TrainingFile.wav when a training grammar is set. the grammar
+and its syllables are loaded once, and a new stream is built for every
+participant while the instructions are on screen.
+"""
+training_stream = {"grammar": None, # grammar and syllable inventory
+                   "sound": None, # pygame.mixer.Sound of the session's stream
+                   "seed": None, # seed of the session's stream
+                   "syllables": [], # syllables of the session's stream
+}
+
+"""
+=== mixer configuration ===
+the mixer is opened at the sample rate, sample size and channel count of the
+stimulus .wav files so that nothing is resampled when a file is loaded. The
+buffer size is the smallest one that passed the calibration, and the delay
+of the channel end events measured by the calibration is written with every
+trial. This is not the output latency of the sound card, which pygame cannot
+measure: end events arrive when the mixer has mixed the last samples, before
+the device has played them.
+"""
+mixer_config = {"frequency": 44100, # sample rate in Hz
+                "size": -16, # sample size in bits, negative for signed samples
+                "channels": 2, # 1 for mono, 2 for stereo
+                "buffer": 512, # mixer buffer size in samples
+                "calibrated": False, # True once the buffer was calibrated on this machine
+                "end_event_delay_ms": None, # measured by calibrate_mixer
+}
+# buffer sizes tried by calibrate_mixer, smallest first
+buffer_sizes = (128, 256, 512, 1024, 2048, 4096)
+# pygame sample size for each .wav sample width in bytes
+wav_sample_sizes = {1: 8, 2: -16, 4: 32}
+
+"""
+=== text and screen cache ===
+rendered text and wrapped text layouts are kept by text, font, width and
+color, and the text of every screen of the experiment is laid out once by
+build_screens. Only the rendered text is kept, not a full frame per screen,
+so the cache stays small at any resolution. Showing a screen fills the text
+of the previous screen with the background, blits the new text and updates
+those rects.
+"""
+text_cache = {"lines": {}, # (text, font, color, background) -> rendered line
+              "layouts": {}, # text_wrap_blit arguments -> word surfaces and positions
+}
+screen_cache = {} # screen name -> (text surfaces and their positions, rects with content)
+# one (screen name, ms since last update, ms spent updating, pixels updated)
+# entry for each screen update of the session
+frame_log = []
+# one (screen name, key, ms since the screen was shown) entry for each key
+# press that ended a wait, written to the trial journal
+key_log = []
+# text of the screens that show one centered line
+screen_texts = {"training": 'Please listen to the training audio.',
+                "continue": 'Press SPACE to begin test trials.',
+                "ready": 'Ready. Please wait for the experimenter.',
+}
+
+# custom pygame event types used by wait_for_event
+AUDIO_END = pygame.USEREVENT + 1 # posted by a mixer channel when a sound ends
+WAIT_TIMEOUT = pygame.USEREVENT + 2 # posted by the timer of a timed wait
+
+"""
+=== timing ===
+all timestamps are taken in nanoseconds from the clock in exp_globals["events"]
+(now_ns), which is monotonic. The dict holds the most recent stamps for the
+screen flip, the audio onset and offset, and the event that ended the last
+wait_for_event call.
+"""
+def now_ns():
+    """returns the time in nanoseconds on the clock of the session."""
+    return exp_globals["events"].now_ns()
+
+timing = {"flip_ns": None, # time the last screen flip returned
+          "audio_onset_ns": None, # time the last sound was started
+          "audio_offset_ns": None, # time the end event of the last sound arrived
+          "event_ns": None, # time the event that ended the last wait arrived
+          "word_ns": [], # (onset, offset) times of the words of the last trial audio
 }
 
 results_out = OrderedDict([("PID", None), # participant number
                            ("trial_num", []), # trial number
                            ("audio_files", []), # trial audio
                            ("responses", []), # trial response
-                           ("rt", []), # trial reaction time
+                           ("rt", []), # trial reaction time (ms, pygame ticks)
+                           ("rt_flip_ms", []), # rt from response screen onset
+                           ("rt_onset_ms", []), # rt from trial audio onset
+                           ("rt_offset_ms", []), # rt from trial audio offset
+                           ("rt_word2_end_ms", []), # rt from the end of the second word
+                           ("end_event_delay_ms", []), # mixer end event delay from the calibration
                            ("accuracy", None) # trial accuracy
 ])
+# keys of results_out that are filled once per session instead of per trial
+session_keys = ("PID", "accuracy")
+
+# timeline of the phases of the running session, allocated once, on the
+# clock of the session
+trace = session_trace.SessionTrace(clock = now_ns)
 
 def run_expt():
     """runs the experiment."""
+    # resolve paths and find the stimuli unless configure_session was called
+    if session_config["base_path"] is None:
+        configure_session()
     # initialize pygame and font
     init_pygame(exp_globals["screen_size"], exp_globals["FPS"])
-    # show main instructions for the experiment.
-    load_instructions()
-    # if debugging, skip the training audio, otherwise play training audio
-    if debug:
-        pass
+    try:
+        # run one participant through the experiment
+        run_session()
+        # report load times and memory of the stimulus bank and the screen
+        # update times to the console
+        print_bank_report()
+        print_frame_report()
+    finally:
+        # exit Experiment, also after a crash
+        close_decoder()
+        pygame.mixer.quit()
+        pygame.quit()
+
+def run_kiosk(max_sessions: int = None):
+    """
+    runs participants back to back in one process. pygame, the display, the
+    mixer, the font and the decoded stimuli are set up once and kept for every
+    participant. Between participants results_out is reset, the trials are
+    shuffled again and a ready screen is shown. The experimenter presses
+    RETURN to start the next participant or ESCAPE to end the kiosk.
+    Headless kiosks need max_sessions, since the simulated experimenter always
+    presses RETURN.
+    max_sessions: int representing the most participants to run, None for no limit
+    """
+    if session_config["base_path"] is None:
+        configure_session()
+    if session_config["headless"] and max_sessions is None:
+        raise ValueError("a headless kiosk never ends without max_sessions")
+    init_pygame(exp_globals["screen_size"], exp_globals["FPS"])
+    # decode every stimulus once for all participants
+    if not session_config["headless"]:
+        preload_stimuli(stimulus_paths())
+
+    n_sessions = 0
+    try:
+        while max_sessions is None or n_sessions < max_sessions:
+            reset_session()
+            if not ready_screen():
+                break
+            run_session()
+            n_sessions += 1
+        print_bank_report()
+    finally:
+        close_decoder()
+        pygame.mixer.quit()
+        pygame.quit()
+
+def ready_screen():
+    """
+    Shows the ready screen between kiosk participants and waits for the
+    experimenter. Returns True on RETURN (start the next participant) and
+    False on ESCAPE (end the kiosk).
+    """
+    show_screen("ready")
+    # drop key presses left over from the last participant
+    exp_globals["events"].clear(pygame.KEYDOWN)
+    event = wait_for_event(keys = (pygame.K_RETURN, pygame.K_ESCAPE))
+    return event.key == pygame.K_RETURN
+
+def stimulus_paths():
+    """
+    Returns the full paths of the audio files that are played from the
+    stimulus bank in the order they are played: the training file unless it
+    is streamed or synthesized, then the test files in trial order.
+    """
+    paths = [os.path.join(session_config["audio_path"], af) for af in session_config["audio_files"]]
+    # a streamed training file is never fully decoded
+    if not (streams_training() or session_config["training_grammar"]):
+        paths.insert(0, session_config["training_file"])
+    return paths
+
+def streams_training():
+    """returns True if the training file is streamed in chunks (only .wav files can be)."""
+    return session_config["stream_training"] and session_config["training_file"].lower().endswith('.wav')
+
+def run_session():
+    """
+    runs one participant through the instructions, training and test trials
+    and writes their results. pygame must already be initialized. If the
+    session fails, the trials already recorded are still synced to the
+    journal so that they can be recovered with trial_journal.py. A failure to
+    save the results on the journal writer thread is raised here.
+    """
+    trace.clear()
+    key_log.clear()
+    start_profile()
+    trace.enter("session")
+    try:
+        # show main instructions for the experiment and decode all stimuli while
+        # they are on screen. Headless runs play nothing, so nothing is decoded.
+        preload = stimulus_paths()
+        if session_config["headless"]:
+            preload = None
+        trace.enter("instructions")
+        load_instructions(preload = preload)
+        trace.exit("instructions")
+        # if debugging, skip the training audio, otherwise play training audio
+        if session_config["debug"]:
+            pass
+        else:
+            # play the training audio
+            trace.enter("training")
+            play_training(session_config["training_file"])
+            trace.exit("training")
+
+        # a wait screen before starting test trials
+        press_to_continue()
+        # start presentation of n trials where n is the number of test audio files
+        start_journal()
+        start_presentation(len(session_config["audio_files"]))
+        # score the responses for the results screen. The results are written
+        # from the journal on its writer thread while the results are on screen.
+        accuracy = trial_journal.score_results(results_out, answer_key)
+        finish_journal()
+        trace.enter("results")
+        blit_results(accuracy)
+        trace.exit("results")
+        exp_globals["journal"].append({"type": "keys", "keys": key_log})
+        trace.exit("session")
+    finally:
+        # as in quit_expt, sync what is in the journal even after a crash
+        close_journal()
+        stop_profile()
+        export_trace()
+
+def reset_session():
+    """
+    clears results_out and shuffles the test trials again (if randomize is
+    set) so that another participant can be run in the same process.
+    """
+    for key in results_out:
+        if key in session_keys:
+            results_out[key] = None
+        else:
+            results_out[key] = []
+    if session_config["randomize"]:
+        shuffle(session_config["audio_files"])
+    frame_log.clear()
+    training_stream["sound"] = None
+    training_stream["seed"] = None
+    training_stream["syllables"] = []
+
+def configure_session(base_path: str = None, results_path: str = None, **options):
+    """
+    Resolves the paths of the experiment and loads the test audio files and
+    the answer key from the stimulus manifest. This must run before
+    init_pygame. Raises ValueError if the manifest is missing or a stimulus
+    the session needs is missing or has changed, so that this is found at
+    startup instead of in the middle of a session.
+    base_path: str representing the folder that holds the subfolders. Defaults
+    to the folder of this module.
+    results_path: str representing the results folder. Defaults to the
+    demo_results subfolder of base_path.
+    options: any of debug, randomize, stream_training, headless,
+    training_grammar, trace, and profile
+    """
+    for key in options:
+        if key not in ("debug", "randomize", "stream_training", "headless", "training_grammar", "trace", "profile"):
+            raise TypeError("unknown session option: " + key)
+    session_config.update(options)
+
+    base_path = os.path.abspath(base_path or module_path)
+    session_config["base_path"] = base_path
+    # creates path to audio folder which is currently named demo_audio
+    session_config["audio_path"] = os.path.join(base_path, audio_folder)
+    # creates path to welcome.txt which should be a subfolder named instructions
+    session_config["instruction_file"] = os.path.join(base_path, instructions_folder, 'welcome.txt')
+    # creates path to the results folder to be used when writing results
+    session_config["results_path"] = os.path.abspath(results_path or os.path.join(base_path, results_folder))
+
+    # fills the audio_files list and the answer key from the manifest
+    manifest = load_manifest(session_config["audio_path"])
+    session_config["manifest"] = manifest
+    # specify the training audio file full path name
+    session_config["training_file"] = os.path.join(session_config["audio_path"], manifest["training_file"])
+    session_config["audio_files"] = stimulus_manifest.test_files(manifest)
+    answer_key.clear()
+    answer_key.update(stimulus_manifest.answer_key(manifest))
+    session_config["segments"] = load_segments(session_config["audio_path"], manifest)
+    # read the grammar and its syllables now, so a bad inventory is found at startup
+    if session_config["training_grammar"]:
+        import stream_synthesis
+        training_stream["grammar"] = stream_synthesis.load_grammar(session_config["training_grammar"])
+    if session_config["randomize"]: # randomizes order of audio_files items if set to True
+        shuffle(session_config["audio_files"])
+
+    if session_config["headless"]:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        exp_globals["events"] = virtual_clock.VirtualClock(simulated_press)
+        # a participant that guesses, unless the caller set one
+        if exp_globals["participant"] is None:
+            import simulated_participants
+            exp_globals["participant"] = simulated_participants.RandomLearner()
     else:
-        # play the training audio
-        play_training(training_file)
-
-    # a wait screen before starting test trials
-    press_to_continue()
-    # start presentation of n trials where n is the number of test audio files
-    start_presentation(num_af)
-    # write results to a file
-    write_responses(results_out)
-    # exit Experiment
-    pygame.mixer.quit()
-    pygame.quit()
+        exp_globals["events"] = virtual_clock.PygameClock()
+    return session_config
+
+def load_cache():
+    """
+    Returns the startup cache of the configured base path, which holds the
+    resolved font paths, the mixer calibration and the stimuli that matched
+    the manifest. Returns an empty cache if there is none or it cannot be read.
+    """
+    cache_file = os.path.join(session_config["base_path"] or module_path, cache_folder, cache_name)
+    try:
+        with open(cache_file, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache: dict):
+    """
+    Writes the startup cache of the configured base path. The cache only
+    speeds up later launches, so a cache that cannot be written is skipped.
+    The file is replaced in one step, so processes reading it at the same
+    time (e.g. headless_runner.py workers) never see it half written.
+    cache: dict representing the startup cache
+    """
+    cache_dir = os.path.join(session_config["base_path"] or module_path, cache_folder)
+    cache_file = os.path.join(cache_dir, cache_name)
+    # write under a temporary name so that a half written file is never read
+    partial = cache_file + '.' + str(os.getpid())
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        with open(partial, 'w') as file:
+            json.dump(cache, file)
+        os.replace(partial, cache_file)
+    except OSError:
+        pass
+
+def load_manifest(audio_path: str):
+    """
+    Returns the stimulus manifest of audio_path after checking the stimuli of
+    the session against it. The test files are always checked, and the
+    training file unless training is skipped (debug), no audio is played
+    (headless) or the training stream is synthesized. A check only stats
+    each file; files are hashed only the first time they are seen with a new
+    size or modification time, and the ones that matched are remembered in
+    the startup cache.
+    audio_path: str representing the full path to the audio folder
+    """
+    manifest = stimulus_manifest.load_manifest(audio_path)
+    if manifest is None:
+        raise ValueError("no stimulus manifest in " + audio_path + ", run stimulus_manifest.py to build it")
+    names = stimulus_manifest.test_files(manifest)
+    if not (session_config["debug"] or session_config["headless"] or session_config["training_grammar"]):
+        names.append(manifest["training_file"])
+
+    cache = load_cache()
+    verified = cache.setdefault("manifest_verified", {}).setdefault(audio_path, {})
+    before = dict(verified)
+    problems = stimulus_manifest.check_files(manifest, audio_path, names, verified)
+    if verified != before:
+        save_cache(cache)
+    if problems:
+        raise ValueError("stimuli do not match the manifest (run stimulus_manifest.py after changing them):\n  " + "\n  ".join(problems))
+    return manifest
+
+def load_segments(audio_path: str, manifest: dict):
+    """
+    Returns the word and syllable times of the stimuli from the segment index
+    in audio_path (see segment_index.py). Entries computed from a file whose
+    hash is not the one in the manifest are left out, as are all entries if
+    there is no index. Trials without an entry get no word aligned rt.
+    audio_path: str representing the full path to the audio folder
+    manifest: dict representing the stimulus manifest
+    """
+    try:
+        with open(os.path.join(audio_path, segments_name), 'r') as file:
+            index = json.load(file)
+    except FileNotFoundError:
+        return {}
+    return {name: entry for name, entry in index.items()
+            if name in manifest["files"] and entry["sha256"] == manifest["files"][name]["sha256"]}
+
+def cached_font_path(name: str):
+    """
+    Returns the path of the system font called name, or None if it is not
+    installed (pygame then uses its default font). Looking up a system font
+    scans every installed font, so the result is cached across launches.
+    name: str representing the font name, e.g. "Arial"
+    """
+    cache = load_cache()
+    fonts = cache.setdefault("fonts", {})
+    if name in fonts and (fonts[name] is None or os.path.exists(fonts[name])):
+        return fonts[name]
+    fonts[name] = pygame.font.match_font(name)
+    save_cache(cache)
+    return fonts[name]
+
+def start_journal():
+    """
+    Opens a trial journal for the session in the results folder and writes its
+    first record, which holds the result keys, the trial order and the answer
+    key so that the session can be recovered from the journal alone.
+    """
+    journal = trial_journal.TrialJournal(trial_journal.new_journal_path(session_config["results_path"]))
+    journal.append({"type": "session",
+                    "started": datetime.now().isoformat(timespec = 'seconds'),
+                    "columns": list(results_out.keys()),
+                    "trial_keys": [key for key in results_out if key not in session_keys],
+                    "audio_files": session_config["audio_files"],
+                    "answer_key": answer_key,
+                    "training_seed": training_stream["seed"],
+                    "training_syllables": ' '.join(training_stream["syllables"])})
+    exp_globals["journal"] = journal
+    # the timeline and profile of the session are named after its journal
+    name = os.path.splitext(os.path.basename(journal.path))[0]
+    exp_globals["trace_path"] = os.path.join(session_config["results_path"], trace_folder, name)
+
+def journal_trial():
+    """
+    Queues the trial that was just recorded in results_out on the journal.
+    The write happens on the journal writer thread.
+    """
+    record = {"type": "trial"}
+    for key in results_out:
+        if key not in session_keys:
+            record[key] = results_out[key][-1]
+    exp_globals["journal"].append(record)
 
-def init_pygame(screen_size: tuple, FPS: int = 60):
+def finish_journal():
+    """
+    Queues a job on the journal writer thread that rebuilds the results from
+    the journal, writes them with write_responses and marks the journal as
+    finished with the PID.
+    """
+    journal = exp_globals["journal"]
+    def save_session():
+        results = trial_journal.results_from_journal(trial_journal.read_journal(journal.path))
+        PID = write_responses(results)
+        journal.write_now({"type": "end", "PID": PID})
+    journal.submit(save_session)
+
+def start_profile():
+    """starts a cProfile of the session if profiling is on."""
+    if session_config["profile"]:
+        import cProfile
+        exp_globals["profiler"] = cProfile.Profile()
+        exp_globals["profiler"].enable()
+
+def stop_profile():
+    """stops the cProfile of the session. It is written by export_trace."""
+    if exp_globals["profiler"] is not None:
+        exp_globals["profiler"].disable()
+
+def export_trace():
+    """
+    Writes the timeline of the session as <journal name>.json in the traces
+    subfolder of the results folder, and its cProfile as <journal name>.prof
+    if profiling is on. Headless sessions are not written, since nothing in
+    them runs in real time. Call once nothing is recorded anymore.
+    """
+    trace_path = exp_globals["trace_path"]
+    if trace_path is not None and session_config["trace"] and not session_config["headless"]:
+        trace.export_chrome(trace_path + '.json', {"audio_files": session_config["audio_files"],
+                                                   "mixer": mixer_config, "FPS": exp_globals["FPS"]})
+    if trace_path is not None and exp_globals["profiler"] is not None:
+        exp_globals["profiler"].dump_stats(trace_path + '.prof')
+    exp_globals["profiler"] = None
+    exp_globals["trace_path"] = None
+
+def close_journal():
+    """
+    waits for the journal writer thread to finish and closes the journal.
+    Raises the error of a job that failed on the writer thread, e.g. if the
+    results could not be saved.
+    """
+    journal = exp_globals["journal"]
+    if journal is not None:
+        exp_globals["journal"] = None
+        journal.close()
+
+def init_pygame(screen_size: tuple = None, FPS: int = 60):
     """
     initializes pygame and screen variables. Also initializes the mixer for
     playing sound.
     arg1 screen_size: tuple representing the X and Y dimensions of the screen.
+    None uses the size of the display as reported by pygame.
     arg2 FPS: static framerate which defaults to 60 fps.
     """
+    # open the mixer in the format of the stimuli when pygame starts
+    configure_mixer()
     pygame.init()
     pygame.display.set_caption(exp_globals["window_caption"])
 
-    # set the initial screen ID for the new display
-    exp_globals["screen"] = pygame.display.set_mode(exp_globals["screen_size"])
+    # used to get screen dimensions
+    if screen_size is None:
+        display_info = pygame.display.Info()
+        screen_size = (display_info.current_w, display_info.current_h)
+    exp_globals["screen_size"] = screen_size
+
+    # set the initial screen ID for the new display. vsync needs a scaled
+    # (hardware rendered) display in pygame 2.
+    if exp_globals["vsync"]:
+        exp_globals["screen"] = pygame.display.set_mode(exp_globals["screen_size"], pygame.SCALED, vsync = 1)
+    else:
+        exp_globals["screen"] = pygame.display.set_mode(exp_globals["screen_size"])
+    exp_globals["current_screen"] = None
     exp_globals["screen_rect"] = exp_globals["screen"].get_rect()
 
     # scale font size to screen dimensions
     font_size = round(exp_globals["screen_size"][0]/1920*50)
-    exp_globals["font"] = pygame.font.SysFont("Arial", font_size)
-    pygame.display.flip()
+    exp_globals["font"] = pygame.font.Font(cached_font_path("Arial"), font_size)
+    flip_screen()
+    # compose every screen of the experiment once
+    build_screens()
 
-    # set frame rate
-    clock = pygame.time.Clock()
-    clock.tick(exp_globals["FPS"])
+    # set frame rate. flip_screen ticks the clock before every update.
+    exp_globals["FPS"] = FPS
+    exp_globals["clock"] = pygame.time.Clock()
+    exp_globals["clock"].tick(exp_globals["FPS"])
 
     # initiate mixer for pygame audio
     pygame.mixer.init()
+    # find the smallest safe buffer once per machine
+    if not mixer_config["calibrated"] and not session_config["headless"]:
+        calibrate_mixer()
+    # the syllables of a training grammar are played in the mixer format as
+    # they are, so a grammar that does not match is found now, not mid-session
+    if training_stream["grammar"] is not None and not session_config["headless"]:
+        check_training_format()
+    # decode upcoming stimuli in the background once the mixer format is set
+    if exp_globals["decoder"] is None:
+        exp_globals["decoder"] = stimulus_decoder.DecodeAhead(load_stimulus, in_bank)
+
+def configure_mixer():
+    """
+    Looks up the formats of the stimuli in the manifest and pre-initializes
+    the mixer to their sample rate, sample size and channel count. If the
+    files do not all share one format, the most common one is used and the
+    others are converted when they are loaded. The buffer size and end event
+    delay from an earlier calibration on this machine are reused. Must be
+    called before pygame.init.
+    """
+    formats = {}
+    for entry in session_config["manifest"]["files"].values():
+        wav_format = (entry["frequency"], entry["sampwidth"], entry["channels"])
+        formats[wav_format] = formats.get(wav_format, 0) + 1
+    if formats:
+        frequency, sampwidth, channels = max(formats, key = formats.get)
+        mixer_config["frequency"] = frequency
+        mixer_config["size"] = wav_sample_sizes.get(sampwidth, -16)
+        mixer_config["channels"] = channels
+
+    mixer_config["calibrated"] = False
+    mixer_config["end_event_delay_ms"] = None
+    calibration = load_cache().get("mixer_calibration", {}).get(mixer_key())
+    # calibrations from before end_event_delay_ms are measured again
+    if calibration and "end_event_delay_ms" in calibration:
+        mixer_config["calibrated"] = True
+        mixer_config["buffer"] = calibration["buffer"]
+        mixer_config["end_event_delay_ms"] = calibration["end_event_delay_ms"]
+    pygame.mixer.pre_init(mixer_config["frequency"], mixer_config["size"], mixer_config["channels"], mixer_config["buffer"])
+
+def mixer_key():
+    """returns the key of the mixer calibration cache for the audio driver and format."""
+    driver = os.environ.get("SDL_AUDIODRIVER", "default")
+    return "{}:{}:{}:{}".format(driver, mixer_config["frequency"], mixer_config["size"], mixer_config["channels"])
+
+def calibrate_mixer(repeats: int = 5, tone_ms: int = 200, timeout_ms: int = 1000):
+    """
+    Finds the smallest mixer buffer that plays without underruns. For each
+    buffer size, smallest first, the mixer is opened and a silent sound of
+    tone_ms milliseconds is played repeats times. The delay of a play is the
+    time from play() to the channel end event minus the length of the sound.
+    A buffer passes if the spread of its delays is under one buffer period and
+    the median delay is under two buffer periods plus 10 ms, i.e. the mixer
+    kept up with the device. A buffer whose end event does not arrive within
+    timeout_ms of the end of the sound fails. The result is kept in
+    mixer_config and cached for later launches. The delay only shows how the
+    mixer keeps up; it is not the output latency of the device. Raises
+    RuntimeError if no buffer size ever sends an end event.
+    repeats: int representing the number of plays for each buffer size
+    tone_ms: int representing the length of the calibration sound
+    timeout_ms: int representing the longest wait for an end event after the sound
+    """
+    frequency, size, channels = mixer_config["frequency"], mixer_config["size"], mixer_config["channels"]
+    n_bytes = frequency * tone_ms // 1000 * channels * abs(size) // 8
+    chosen = None
+    for buffer in buffer_sizes:
+        pygame.mixer.quit()
+        pygame.mixer.init(frequency, size, channels, buffer)
+        silence = pygame.mixer.Sound(buffer = bytes(n_bytes))
+        delays = []
+        for k in range(repeats):
+            channel = pygame.mixer.find_channel(True)
+            exp_globals["events"].clear(AUDIO_END)
+            channel.set_endevent(AUDIO_END)
+            start_ns = now_ns()
+            exp_globals["events"].play(channel, silence, tone_ms)
+            event = wait_for_event(channel = channel, timeout = tone_ms + timeout_ms)
+            channel.set_endevent()
+            if event.type != AUDIO_END:
+                channel.stop()
+                break
+            delays.append((timing["event_ns"] - start_ns) / 1e6 - tone_ms)
+        if len(delays) < repeats:
+            continue
+        delays.sort()
+        median_ms = delays[len(delays) // 2]
+        buffer_ms = buffer / frequency * 1000
+        chosen = (buffer, round(median_ms, 3))
+        if delays[-1] - delays[0] < buffer_ms and median_ms < 2 * buffer_ms + 10:
+            break
+    if chosen is None:
+        raise RuntimeError("the audio device never reported the end of a sound, so sounds cannot be timed on it")
+
+    # keep the mixer open with the chosen buffer (the largest that sent end events if none passed)
+    if pygame.mixer.get_init() is None or buffer != chosen[0]:
+        pygame.mixer.quit()
+        pygame.mixer.init(frequency, size, channels, chosen[0])
+    mixer_config["buffer"], mixer_config["end_event_delay_ms"] = chosen
+    mixer_config["calibrated"] = True
+    cache = load_cache()
+    cache.setdefault("mixer_calibration", {})[mixer_key()] = {"buffer": chosen[0], "end_event_delay_ms": chosen[1]}
+    save_cache(cache)
+
+def render_line(text: str):
+    """
+    Returns text rendered in the experiment font and colors. Rendered lines
+    are cached, so each one is only rendered once.
+    text: str representing one line of text
+    """
+    key = (text, exp_globals["font"], exp_globals["text_color"], exp_globals["bg_color"])
+    if key not in text_cache["lines"]:
+        text_cache["lines"][key] = exp_globals["font"].render(text, True, exp_globals["text_color"], exp_globals["bg_color"])
+    return text_cache["lines"][key]
+
+def compose_screen(items: list):
+    """
+    Returns the rendered text items of a screen as a list of (surface, rect)
+    pairs to blit on the background, and the list of rects they cover.
+    items: list of (text, center) pairs, center being the (X, Y) center of the text
+    """
+    blits = []
+    rects = []
+    for text, center in items:
+        text_item = render_line(text)
+        text_item_rect = text_item.get_rect()
+        text_item_rect.center = center
+        blits.append((text_item, text_item_rect))
+        rects.append(text_item_rect)
+    return blits, rects
 
-def load_instructions():
+def make_screen(name: str):
+    """
+    Composes the screen called name and returns its text surfaces with their
+    positions and the rects that have content (see compose_screen). The names are 'instructions', 'blank',
+    'response', 'trial N' for test trial N, 'results C/N' for C of N correct,
+    and the names in screen_texts.
+    name: str representing the name of the screen
+    """
+    center = exp_globals["screen_rect"].center
+    if name == "instructions":
+        with open(session_config["instruction_file"], 'r') as file:
+            infile = file.read()
+        # the wrapped words of the instructions, as text_wrap_blit places them
+        layout = wrap_layout(infile, exp_globals["font"], exp_globals["screen_size"][0] - 100, (50, 50),exp_globals["text_color"])
+        rects = []
+        if layout:
+            rects = [pygame.Rect(layout[0][1], layout[0][0].get_size()).unionall([pygame.Rect(position, word_surface.get_size()) for word_surface, position in layout])]
+        return list(layout), rects
+    elif name == "blank":
+        return compose_screen([])
+    elif name == "response":
+        # response instructions at the center of the left and right screen,
+        # and the question above them
+        return compose_screen([("LEFT SHIFT for sound 1.", (center[0] - exp_globals["screen_size"][0]/4, center[1])),
+                               (" RIGHT SHIFT for sound 2.", (center[0] + exp_globals["screen_size"][0]/4, center[1])),
+                               ("Which sound was the real word?", (center[0], center[1]/2))])
+    elif name.startswith("trial "):
+        return compose_screen([('Test Trial ' + name[len("trial "):], center)])
+    elif name.startswith("results "):
+        num_correct, num_items = name[len("results "):].split('/')
+        return compose_screen([("You got ( " + num_correct + " / " + num_items + " )  correct.", center)])
+    return compose_screen([(screen_texts[name], center)])
+
+def build_screens():
+    """
+    Composes every screen of the experiment into screen_cache, including one
+    screen for each test trial. Called by init_pygame once the display and
+    the font are ready. Screens that depend on the score are composed the
+    first time they are shown.
+    """
+    screen_cache.clear()
+    text_cache["lines"].clear()
+    text_cache["layouts"].clear()
+    names = ["instructions", "blank", "response"] + list(screen_texts)
+    names += ["trial " + str(m + 1) for m in range(len(session_config["audio_files"]))]
+    for name in names:
+        screen_cache[name] = make_screen(name)
+
+def show_screen(name: str):
+    """
+    Shows the screen called name. Only the dirty regions are drawn and
+    updated: the rects with content on the screen being replaced are filled
+    with the background and the text of the new screen is blitted. Everything
+    else is background on both. The first screen after init_pygame is drawn
+    and flipped in full. A screen that is not in screen_cache yet is composed
+    and kept for next time.
+    name: str representing the name of the screen (see make_screen)
+    """
+    if name not in screen_cache:
+        screen_cache[name] = make_screen(name)
+    blits, rects = screen_cache[name]
+    previous = exp_globals["current_screen"]
+    screen = exp_globals["screen"]
+    if previous is None:
+        screen.fill(exp_globals["bg_color"])
+        screen.blits(blits, doreturn = False)
+        flip_screen(name = name)
+    else:
+        old_rects = screen_cache[previous][1]
+        for rect in old_rects:
+            screen.fill(exp_globals["bg_color"], rect)
+        screen.blits(blits, doreturn = False)
+        flip_screen(rects + old_rects, name)
+    exp_globals["current_screen"] = name
+
+def load_instructions(preload: list = None):
     """
     Loads main experiment instructions from a text file named welcome.txt which
     is located in a subfolder named instructions. The instructions are then
     blipped onto the screen using text_wrap_blit to wrap the text as needed. The
     particpants have to press ENTER or RETURN to continue with the experiment.
+    While the instructions are on screen, the audio files in preload are
+    decoded into the stimulus bank and the training stream is synthesized if
+    a training grammar is set.
+    preload: list of full paths to audio files to load into the stimulus bank
     """
-    with open(instruction_file, 'r') as file:
-        infile = file.read()
+    # show the instructions screen composed at startup
+    show_screen("instructions")
+    # start decoding the stimuli while participants read the instructions
+    if preload:
+        preload_stimuli(preload)
+    if session_config["training_grammar"] and not session_config["headless"]:
+        make_training_stream()
+    pause(500) # wait at least 500 ms before allowing one to continue
 
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-
-    # blit wrapped text for instructions to main screen
-    text_wrap_blit(exp_globals["screen"], infile, exp_globals["font"], exp_globals["screen_size"][0] - 100, (50, 50),exp_globals["text_color"])
-    pygame.display.flip()
-    pygame.time.wait(500) # wait at least 500 ms before allowing one to continue
-
-    # Loop to wait for participants to press SPACE before moving on
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    waiting = False
+    # wait for participants to press SPACE before moving on
+    wait_for_event(keys = (pygame.K_SPACE,))
 
 def play_training(training_file: str):
     """
     This function is used to play the training audio file 'TrainingFile.wav'
     which is located in the demo_audio subfolder. It will play the file until
     it ends and then stops. If debug is set to True, training will be skipped.
+    If stream_training is set to True, the file is streamed in chunks instead
+    of being taken from the stimulus bank.
+    A synthesized training stream from make_training_stream is played instead
+    of the file if there is one.
     training_file: string representing full path to training file
     """
-    # load training file
-    training_audio = pygame.mixer.Sound(training_file)
-
     # display training instructions
-    instructions = 'Please listen to the training audio.'
+    show_screen("training")
 
-    # render text_item
-    text_item = exp_globals["font"].render(instructions, True, exp_globals["text_color"], exp_globals["bg_color"])
-    # get text item rect
-    text_item_rect = text_item.get_rect()
-    # place text at center of the screen
-    text_item_rect.center = exp_globals["screen_rect"].center
+    if training_stream["sound"] is not None:
+        play_sound(training_stream["sound"], training_stream["sound"].get_length() * 1000)
+        return
 
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-    # draw to backbuffer
-    exp_globals["screen"].blit(text_item, text_item_rect)
-    pygame.display.flip()
+    if streams_training() and not session_config["headless"]:
+        play_stream(training_file, stream_chunk_ms)
+        return
 
+    # get the decoded training file from the stimulus bank
+    training_audio = get_stimulus(training_file)
     # play audio_file until end
-    playing = training_audio.play()
-    while playing.get_busy():
-        pygame.time.wait(60)
-    # close audio_file
-    training_audio.stop()
+    play_sound(training_audio, stimulus_length_ms(training_file))
+
+def check_training_format():
+    """
+    Raises ValueError if the syllables of the training grammar do not match
+    the sample rate of the mixer or the mixer is not 16 bit. Called by
+    init_pygame once the mixer is open.
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    if training_stream["grammar"]["frequency"] != frequency or abs(size) != 16:
+        raise ValueError("the syllables must be 16 bit at the {} Hz of the mixer".format(frequency))
+
+def make_training_stream():
+    """
+    Synthesizes a new training stream from the training grammar with a random
+    seed and keeps it in training_stream. The samples are handed to the
+    mixer as they are, without writing a .wav file. The format of the
+    syllables was checked by check_training_format at startup.
+    """
+    import stream_synthesis
+    channels = pygame.mixer.get_init()[2]
+    training_stream["seed"] = int.from_bytes(os.urandom(4), 'little')
+    stream, training_stream["syllables"] = stream_synthesis.synthesize(training_stream["grammar"], training_stream["seed"])
+    training_stream["sound"] = pygame.mixer.Sound(buffer = stream_synthesis.mixer_buffer(stream, channels))
+
+def sound_nbytes(sound: pygame.mixer.Sound):
+    """
+    Returns the number of bytes of decoded audio held by a sound. The size is
+    worked out from the sound length and the mixer format so the samples do not
+    have to be copied.
+    sound: pygame.mixer.Sound object
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    n_samples = round(sound.get_length() * frequency)
+    return n_samples * channels * abs(size) // 8
+
+def load_stimulus(audio_file: str, during_trial: bool = False):
+    """
+    Decodes an audio file into the stimulus bank and records how long the load
+    took and how much memory the decoded audio uses. Least recently used sounds
+    that are not upcoming are evicted until the bank is back within its memory
+    budget, or until only upcoming sounds are left.
+    audio_file: str representing the full path to an audio file.
+    during_trial: bool, True if the load happened at presentation time
+    """
+    start_time = time.perf_counter()
+    sound = stimulus_decoder.decode(audio_file, stimulus_hash(audio_file), os.path.join(session_config["base_path"], cache_folder))
+    load_ms = (time.perf_counter() - start_time) * 1000
+    nbytes = sound_nbytes(sound)
+
+    with stimulus_bank["lock"]:
+        # keep the stats of earlier loads so that reloads can be counted
+        stats = stimulus_bank["stats"].setdefault(audio_file, {"loads": 0, "trial_loads": 0, "trial_waits": 0, "wait_ms": 0})
+        stats["loads"] += 1
+        stats["load_ms"] = load_ms
+        stats["bytes"] = nbytes
+        if during_trial:
+            stats["trial_loads"] += 1
+
+        # the other thread may have loaded the same file meanwhile
+        if audio_file in stimulus_bank["sounds"]:
+            return stimulus_bank["sounds"][audio_file]
+        stimulus_bank["sounds"][audio_file] = sound
+        stimulus_bank["resident_bytes"] += nbytes
+
+        # evict the least recently used sounds that were already played, never
+        # an upcoming one or the one just loaded
+        played = [path for path in stimulus_bank["sounds"] if path != audio_file and path not in stimulus_bank["upcoming"]]
+        for old_file in played:
+            if stimulus_bank["resident_bytes"] <= stimulus_bank["budget"]:
+                break
+            stimulus_bank["resident_bytes"] -= sound_nbytes(stimulus_bank["sounds"].pop(old_file))
+    return sound
+
+def stimulus_hash(audio_file: str):
+    """
+    Returns the hash of audio_file in the stimulus manifest, or None if it is
+    not in the manifest.
+    audio_file: str representing the full path to an audio file.
+    """
+    entry = session_config["manifest"]["files"].get(os.path.basename(audio_file))
+    return entry and entry["sha256"]
+
+def stimulus_length_ms(audio_file: str):
+    """
+    Returns the length of audio_file in milliseconds from the stimulus
+    manifest, or 0 if it is not in the manifest.
+    audio_file: str representing the full path to an audio file.
+    """
+    entry = session_config["manifest"]["files"].get(os.path.basename(audio_file))
+    return entry["duration_ms"] if entry else 0
+
+def expected_nbytes(audio_file: str):
+    """
+    Returns the number of bytes audio_file will take once decoded to the mixer
+    format, worked out from the stimulus manifest, or 0 if it is not in the
+    manifest.
+    audio_file: str representing the full path to an audio file.
+    """
+    entry = session_config["manifest"]["files"].get(os.path.basename(audio_file))
+    if not entry:
+        return 0
+    frequency, size, channels = pygame.mixer.get_init()
+    return round(entry["frames"] * frequency / entry["frequency"]) * channels * abs(size) // 8
+
+def decode_window():
+    """
+    Returns the upcoming stimuli that are decoded ahead: as many of the next
+    ones as fit the memory budget together, and always the next one.
+    """
+    window = []
+    total = 0
+    with stimulus_bank["lock"]:
+        for audio_file in stimulus_bank["upcoming"]:
+            total += expected_nbytes(audio_file)
+            if window and total > stimulus_bank["budget"]:
+                break
+            window.append(audio_file)
+    return window
+
+def in_bank(audio_file: str):
+    """returns True if audio_file is decoded in the stimulus bank."""
+    with stimulus_bank["lock"]:
+        return audio_file in stimulus_bank["sounds"]
+
+def preload_stimuli(audio_files: list):
+    """
+    Sets audio_files as the upcoming stimuli, in the order they are played,
+    and queues the ones in the decode window to be decoded into the stimulus
+    bank by the background decoder. Returns straight away. Files that are
+    already in the bank are not loaded again.
+    audio_files: list of full paths to audio files
+    """
+    with stimulus_bank["lock"]:
+        stimulus_bank["upcoming"] = list(audio_files)
+    exp_globals["decoder"].schedule(decode_window())
+
+def advance_window(audio_file: str):
+    """
+    Marks audio_file as played, so that it can be evicted, and queues the
+    stimuli in the decode window that are not decoded, including any that
+    moved into it and any that were evicted.
+    audio_file: str representing the full path to the audio file being played
+    """
+    with stimulus_bank["lock"]:
+        if audio_file in stimulus_bank["upcoming"]:
+            stimulus_bank["upcoming"].remove(audio_file)
+    exp_globals["decoder"].schedule(decode_window())
+
+def get_stimulus(audio_file: str):
+    """
+    Returns the decoded sound for audio_file from the stimulus bank, marks it
+    as most recently used and moves the decode window on past it. If the
+    background decoder has not got to the file yet it decodes it next, and
+    the trial waits for it; the wait is counted in the bank stats. A file the
+    decoder could not load is decoded here and counted as a trial load.
+    Headless runs play nothing, so they get None instead of a sound.
+    audio_file: str representing the full path to an audio file.
+    """
+    if session_config["headless"]:
+        return None
+    with stimulus_bank["lock"]:
+        sound = stimulus_bank["sounds"].get(audio_file)
+        if sound is not None:
+            stimulus_bank["sounds"].move_to_end(audio_file)
+    if sound is None:
+        start_time = time.perf_counter()
+        exp_globals["decoder"].fetch(audio_file)
+        wait_ms = (time.perf_counter() - start_time) * 1000
+        with stimulus_bank["lock"]:
+            sound = stimulus_bank["sounds"].get(audio_file)
+        if sound is None:
+            sound = load_stimulus(audio_file, during_trial = True)
+        with stimulus_bank["lock"]:
+            stats = stimulus_bank["stats"][audio_file]
+            stats["trial_waits"] += 1
+            stats["wait_ms"] += wait_ms
+    advance_window(audio_file)
+    return sound
+
+def close_decoder():
+    """stops the background decoder. Must be called before the mixer is closed."""
+    if exp_globals["decoder"] is not None:
+        exp_globals["decoder"].close()
+        exp_globals["decoder"] = None
+
+def print_bank_report():
+    """
+    Prints the load time and resident memory of every file in the stimulus
+    bank. The trial waits column shows how many times a trial had to wait for
+    its file to be decoded (wait_ms in total), and the trial loads column how
+    many times a file had to be decoded on the main thread. Both should
+    always be 0.
+    """
+    print("{:<20} {:>10} {:>10} {:>8} {:>12} {:>10} {:>12}".format("file", "load_ms", "kB", "loads", "trial_waits", "wait_ms", "trial_loads"))
+    for audio_file, stats in stimulus_bank["stats"].items():
+        print("{:<20} {:>10.2f} {:>10.1f} {:>8} {:>12} {:>10.2f} {:>12}".format(os.path.basename(audio_file), stats["load_ms"], stats["bytes"] / 1024,
+              stats["loads"], stats["trial_waits"], stats["wait_ms"], stats["trial_loads"]))
+    print("resident: {:.1f} kB of {:.1f} kB budget".format(stimulus_bank["resident_bytes"] / 1024, stimulus_bank["budget"] / 1024))
+
+def wav_chunks(audio_file: str, chunk_ms: int = 500):
+    """
+    Generator that reads a .wav file in chunks of chunk_ms milliseconds and
+    yields each chunk as a pygame.mixer.Sound. Only one chunk is read from disk
+    at a time, so memory use does not grow with the length of the file. Each
+    chunk is wrapped in a small in-memory .wav so the mixer converts it to its
+    own sample rate and format.
+    audio_file: str representing the full path to a .wav file
+    chunk_ms: int representing the length of each chunk in milliseconds
+    """
+    with wave.open(audio_file, 'rb') as wav:
+        params = wav.getparams()
+        chunk_frames = max(1, params.framerate * chunk_ms // 1000)
+        while True:
+            frames = wav.readframes(chunk_frames)
+            if not frames:
+                break
+            # write the raw frames into an in-memory .wav with the same header
+            buffer = io.BytesIO()
+            with wave.open(buffer, 'wb') as chunk:
+                chunk.setparams(params)
+                chunk.writeframes(frames)
+            buffer.seek(0)
+            yield pygame.mixer.Sound(file = buffer)
+
+def play_stream(audio_file: str, chunk_ms: int = 500):
+    """
+    Streams a .wav file through a mixer channel. The first chunk starts playing
+    as soon as it is read and every following chunk is queued on the same
+    channel while the one before it plays. At most three chunks are held in
+    memory at once: the playing one, the queued one, and the one being read.
+    audio_file: str representing the full path to a .wav file
+    chunk_ms: int representing the length of each chunk in milliseconds
+    """
+    chunks = wav_chunks(audio_file, chunk_ms)
+    first_chunk = next(chunks, None)
+    if first_chunk is None: # nothing to play
+        return
+    channel = pygame.mixer.find_channel(True)
+    # the channel posts AUDIO_END every time one of the chunks ends
+    exp_globals["events"].clear(AUDIO_END)
+    channel.set_endevent(AUDIO_END)
+    channel.play(first_chunk)
+    second_chunk = next(chunks, None)
+    if second_chunk is not None:
+        channel.queue(second_chunk)
+    for chunk in chunks:
+        # a chunk ended, so the queued one is playing and the queue slot is free
+        wait_for_event(channel = channel)
+        channel.queue(chunk)
+    # wait for the remaining chunks to finish
+    while channel.get_busy():
+        wait_for_event(channel = channel)
+    channel.set_endevent()
+
+def quit_expt():
+    """
+    closes pygame and exits the program when the window is closed. Trials
+    already in the journal are synced to disk first so the session can be
+    recovered with trial_journal.py.
+    """
+    close_journal()
+    close_decoder()
+    stop_profile()
+    export_trace()
+    pygame.quit()
+    sys.exit()
+
+def wait_for_event(keys: tuple = (), any_key: bool = False, timeout: int = None, channel: pygame.mixer.Channel = None):
+    """
+    Blocks on the pygame event queue until the wait is over and returns the
+    event that ended it. The process sleeps while no event arrives, so waiting
+    uses no CPU. A wait ends on a KEYDOWN for one of keys (or any key if
+    any_key is True), on the AUDIO_END event of channel, or when the timeout
+    timer fires. Closing the window ends the experiment. Every key press that
+    ends a wait is added to key_log.
+    keys: tuple of pygame key constants that end the wait
+    any_key: bool, if True, any key press ends the wait
+    timeout: int representing the longest wait in milliseconds, None waits forever
+    channel: pygame.mixer.Channel whose end event ends the wait. The caller
+    sets AUDIO_END as the end event of the channel before playing on it.
+    """
+    events = exp_globals["events"]
+    if timeout is not None:
+        # one shot timer that posts WAIT_TIMEOUT when the wait is over
+        events.clear(WAIT_TIMEOUT)
+        events.set_timer(WAIT_TIMEOUT, max(1, timeout))
+    if keys or any_key:
+        # a virtual clock schedules the key press of its participant now
+        events.expect_keys(keys, any_key)
+    try:
+        while True:
+            event = events.next_event()
+            # stamp the event before doing anything else with it
+            timing["event_ns"] = now_ns()
+            if event.type == pygame.QUIT:
+                quit_expt()
+            elif event.type == pygame.KEYDOWN:
+                if any_key or event.key in keys:
+                    key_log.append((exp_globals["current_screen"], event.key, ns_to_ms(timing["flip_ns"], timing["event_ns"])))
+                    return event
+            elif event.type == AUDIO_END and channel is not None:
+                return event
+            elif event.type == WAIT_TIMEOUT and timeout is not None:
+                return event
+    finally:
+        if timeout is not None:
+            # cancel the timer in case the wait ended before it fired
+            events.set_timer(WAIT_TIMEOUT, 0)
+
+def pause(duration: int):
+    """
+    Sleeps for duration milliseconds. On a virtual clock (headless runs) only
+    the virtual time moves on.
+    duration: int representing the pause in milliseconds
+    """
+    exp_globals["events"].wait(duration)
+
+def simulated_press(keys: tuple, any_key: bool):
+    """
+    Returns the (delay in ms, key) a simulated participant presses for a wait
+    on keys, without delay. On the response screen the participant in
+    exp_globals["participant"] chooses sound 1 or 2 for the current trial.
+    Any other wait is ended with the first accepted key, or SPACE if any key
+    is accepted.
+    keys: tuple of pygame key constants that end the wait
+    any_key: bool, True if any key ends the wait
+    """
+    if pygame.K_LSHIFT in keys:
+        choice = exp_globals["participant"].choose(results_out["audio_files"][-1])
+        key = pygame.K_LSHIFT if choice == 1 else pygame.K_RSHIFT
+    elif keys:
+        key = keys[0]
+    else:
+        key = pygame.K_SPACE
+    return 0, key
+
+def play_sound(sound: pygame.mixer.Sound, length_ms: float = 0):
+    """
+    Plays a sound on a free mixer channel and returns when it has finished.
+    The end of the sound is taken from the AUDIO_END event of the channel
+    rather than by polling whether the channel is busy.
+    sound: pygame.mixer.Sound object, None in headless runs
+    length_ms: float representing the length of the sound, used by a virtual clock
+    """
+    channel = pygame.mixer.find_channel(True)
+    # drop end events left over from earlier sounds
+    exp_globals["events"].clear(AUDIO_END)
+    channel.set_endevent(AUDIO_END)
+    exp_globals["events"].play(channel, sound, length_ms)
+    timing["audio_onset_ns"] = now_ns()
+    trace.mark("audio_onset", time_ns = timing["audio_onset_ns"])
+    wait_for_event(channel = channel)
+    timing["audio_offset_ns"] = timing["event_ns"]
+    trace.mark("audio_offset", time_ns = timing["audio_offset_ns"])
+    channel.set_endevent()
+
+def flip_screen(rects: list = None, name: str = None):
+    """
+    Updates the display and stamps the time the update returned in
+    timing["flip_ns"]. This is used as the onset time of the new screen.
+    Updates are paced by the clock so there are never more than FPS of them
+    per second. Only rects are updated if given, otherwise the whole display
+    is flipped. Each update is logged in frame_log.
+    rects: list of pygame.Rect objects to update, None updates everything
+    name: str representing the name of the screen, for frame_log
+    """
+    if exp_globals["clock"] is not None:
+        exp_globals["events"].pace(exp_globals["clock"], exp_globals["FPS"])
+    start_ns = now_ns()
+    if rects is None:
+        pygame.display.flip()
+        area = exp_globals["screen_size"][0] * exp_globals["screen_size"][1]
+    else:
+        pygame.display.update(rects)
+        area = sum(rect.width * rect.height for rect in rects)
+    timing["flip_ns"] = now_ns()
+    trace.mark("flip", time_ns = timing["flip_ns"])
+    since_last = exp_globals["clock"].get_time() if exp_globals["clock"] is not None else 0
+    frame_log.append((name, since_last, (timing["flip_ns"] - start_ns) / 1e6, area))
+
+def print_frame_report():
+    """
+    Prints the screen updates in frame_log: how long each took and how many
+    pixels were updated.
+    """
+    print("{:<16} {:>12} {:>10} {:>12}".format("screen", "since_ms", "update_ms", "pixels"))
+    for name, since_last, update_ms, area in frame_log:
+        print("{:<16} {:>12} {:>10.3f} {:>12}".format(str(name), since_last, update_ms, area))
+
+def ns_to_ms(start_ns: int, end_ns: int):
+    """
+    Returns the time from start_ns to end_ns in milliseconds rounded to
+    microseconds, or None if the start time was never stamped.
+    """
+    if start_ns is None:
+        return None
+    return round((end_ns - start_ns) / 1e6, 3)
 
 def ISI(duration: int = 500):
     """
     Used to draw an inter stimulus interval.
     duration: int representing interstimulus interval duration in milliseconds
     """
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-    pygame.display.flip()
+    trace.enter("ISI", duration)
+    # show a blank screen
+    show_screen("blank")
 
     # wait for ISI, default duration = 500
-    pygame.time.wait(duration)
+    pause(duration)
+    trace.exit("ISI", duration)
 
 def press_to_continue():
     # display instructions
-    instructions = 'Press SPACE to begin test trials.'
-
-    # render textItem
-    text_item = exp_globals["font"].render(instructions, True, exp_globals["text_color"], exp_globals["bg_color"])
-    # get text item rect
-    text_item_rect = text_item.get_rect()
-    # place at center of the screen
-    text_item_rect.center = exp_globals["screen_rect"].center
-
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-    # draw to backbuffer
-    exp_globals["screen"].blit(text_item, text_item_rect)
-    pygame.display.flip()
-    pygame.time.wait(500) # wait at least 500 ms before allowing one to continue
-
-    # Loop to wait for participants to press SPACE before moving on
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    waiting = False
+    show_screen("continue")
+    pause(500) # wait at least 500 ms before allowing one to continue
+
+    # wait for participants to press SPACE before moving on
+    wait_for_event(keys = (pygame.K_SPACE,))
 
 # wrapper function that calls the audio function and the responses function.
 def start_presentation(n_trials: int = 2):
@@ -273,18 +1368,21 @@ def start_presentation(n_trials: int = 2):
     test trials.
     n_trials: int represents the number of trials based on audio_files list
     """
-    if debug:
+    if session_config["debug"]:
         n_trials = 2
+    trace.enter("start_presentation", n_trials)
+    audio_files = session_config["audio_files"]
     for m in range(n_trials):
         if(audio_files == []):
             pass
         else:
             ISI()
             results_out["audio_files"].append(audio_files[m])
-            af = os.path.join(audio_path,audio_files[m])
+            af = os.path.join(session_config["audio_path"],audio_files[m])
             # print(af)
             play_audio(af, m+1)
             get_responses(m+1) # pass m + 1 in a trial number
+    trace.exit("start_presentation", n_trials)
 
 def play_audio(audio_file: str, trial_num: int):
     """
@@ -293,133 +1391,78 @@ def play_audio(audio_file: str, trial_num: int):
     audio_file: str representing the full path to an audio file.
     trial_num: int representing current trial number.
     """
-    # load audio audio_file
-    speechfile = pygame.mixer.Sound(audio_file)
+    trace.enter("play_audio", trial_num)
+    # get the decoded audio_file from the stimulus bank
+    speechfile = get_stimulus(audio_file)
 
-    # display instructions
-    instructions = 'Test Trial ' + str(trial_num)
-
-    # render textItem
-    text_item = exp_globals["font"].render(instructions, True, exp_globals["text_color"], exp_globals["bg_color"])
-    # get text item rect
-    text_item_rect = text_item.get_rect()
-    # place at center of the screen
-    text_item_rect.center = exp_globals["screen_rect"].center
-
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-    # draw to backbuffer
-    exp_globals["screen"].blit(text_item, text_item_rect)
-    pygame.display.flip()
-
-    # play audio_file k times pausing for 1 second between
-    playing = speechfile.play()
-    # checks to see if the file is still playing and stops when it's done
-    while playing.get_busy():
-        pygame.time.wait(60)
-    # stop audio_file
-    speechfile.stop()
+    # display the trial number
+    show_screen("trial " + str(trial_num))
+
+    # play audio_file until it ends
+    play_sound(speechfile, stimulus_length_ms(audio_file))
+    # time the words from the audio onset and the precomputed segment index
+    segments = session_config["segments"].get(os.path.basename(audio_file), {"words": []})
+    timing["word_ns"] = [(timing["audio_onset_ns"] + int(onset * 1e6), timing["audio_onset_ns"] + int(offset * 1e6))
+                         for onset, offset in segments["words"]]
+    trace.exit("play_audio", trial_num)
 # record response
 def get_responses(trial_num: int):
     """
     This function is designed to wait for a keyboard event where people indicate
     either the first or second sound as the correct sound item. Pressing the
     left SHIFT key indicates sound1. Pressing the right SHIFT key indicates
-    sound2. It then stores this response in results_out["responses"].
+    sound2. It then stores this response in results_out["responses"]. The
+    key press is stamped when it is taken off the event queue. pygame does not
+    report when the key was pressed, so its delivery delay is part of every
+    rt and is not measured.
     trial_num: int representing current trial
     """
-    # display instructions
-    instructions1 = "LEFT SHIFT for sound 1."
-    instructions2 = " RIGHT SHIFT for sound 2."
-    instructions_center = "Which sound was the real word?"
-
-    # render textItems for response instructions
-    text_item1 = exp_globals["font"].render(instructions1, True, exp_globals["text_color"], exp_globals["bg_color"])
-    text_item2 = exp_globals["font"].render(instructions2, True, exp_globals["text_color"], exp_globals["bg_color"])
-    text_item3 = exp_globals["font"].render(instructions_center, True, exp_globals["text_color"], exp_globals["bg_color"])
-
-    # get text item rects
-    text_item_rect1 = text_item1.get_rect()
-    text_item_rect2 = text_item2.get_rect()
-    text_item_rect3 = text_item3.get_rect()
-
-    # place at text rects at center of the left and right screen
-    text_item_rect1.center = (exp_globals["screen_rect"].center[0] -exp_globals["screen_size"][0]/4,exp_globals["screen_rect"].center[1])
-    text_item_rect2.center = (exp_globals["screen_rect"].center[0] + exp_globals["screen_size"][0]/4,exp_globals["screen_rect"].center[1])
-    text_item_rect3.center = (exp_globals["screen_rect"].center[0], exp_globals["screen_rect"].center[1]/2)
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-
-    # draw text to backbuffer
-    exp_globals["screen"].blit(text_item1, text_item_rect1)
-    exp_globals["screen"].blit(text_item2, text_item_rect2)
-    exp_globals["screen"].blit(text_item3, text_item_rect3)
-    pygame.display.flip()
-    start_time = pygame.time.get_ticks()
+    trace.enter("get_responses", trial_num)
+    # display response instructions
+    show_screen("response")
+    start_time = exp_globals["events"].ticks()
     # waits for a response and then records it to exp_globals.
-    pygame.event.clear()
-    waiting = True
-    while waiting:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                # Respond to a keypress LSHIFT and RSHIFT
-                if event.key == pygame.K_LSHIFT:
-                    click_time = pygame.time.get_ticks()
-                    rt = click_time - start_time
-                    results_out["trial_num"].append(trial_num)
-                    results_out["responses"].append(1)
-                    results_out["rt"].append(rt)
-                    waiting = False
-                elif event.key == pygame.K_RSHIFT:
-                    click_time = pygame.time.get_ticks()
-                    rt = click_time - start_time
-                    results_out["trial_num"].append(trial_num)
-                    results_out["responses"].append(2)
-                    results_out["rt"].append(rt)
-                    waiting = False
+    exp_globals["events"].clear()
+    event = wait_for_event(keys = (pygame.K_LSHIFT, pygame.K_RSHIFT))
+    key_ns = timing["event_ns"]
+    trace.mark("key", event.key, key_ns)
+    click_time = exp_globals["events"].ticks()
+    rt = click_time - start_time
+    # Respond to a keypress LSHIFT and RSHIFT
+    results_out["trial_num"].append(trial_num)
+    if event.key == pygame.K_LSHIFT:
+        results_out["responses"].append(1)
+    else:
+        results_out["responses"].append(2)
+    results_out["rt"].append(rt)
+    # high resolution rts from the response screen onset and the trial audio
+    results_out["rt_flip_ms"].append(ns_to_ms(timing["flip_ns"], key_ns))
+    results_out["rt_onset_ms"].append(ns_to_ms(timing["audio_onset_ns"], key_ns))
+    results_out["rt_offset_ms"].append(ns_to_ms(timing["audio_offset_ns"], key_ns))
+    word2_end_ns = timing["word_ns"][1][1] if len(timing["word_ns"]) > 1 else None
+    results_out["rt_word2_end_ms"].append(ns_to_ms(word2_end_ns, key_ns))
+    results_out["end_event_delay_ms"].append(mixer_config["end_event_delay_ms"])
+    # append the trial to the journal straight away
+    journal_trial()
+    trace.exit("get_responses", trial_num)
 
 def write_responses(results: dict):
     """
     This function is used to write the results to a .csv file. It first looks at
-    the responses and compares them to the correct responses in exp_globals. It
-    then calculates the accuracy of each response and saves this. It then checks
-    the results folder for files. PID will be file count + 1. It then writes the
-    results as demo_results#.csv where # represents the PID number. Therefore,
-    this folder should not include any other files except results output files.
+    the responses and compares them to the correct responses in answer_key. It
+    then calculates the accuracy of each response and saves this. The PID is
+    allocated by the results store in the results folder (see results_store.py)
+    and the trials are saved there. It then exports the results as results#.csv
+    where # represents the PID number. Other files in the results folder do not
+    affect the PID. Returns the PID.
     results: dictionary representing the trial by trial data and results.
     """
-    accuracy = []
-    for k in range(len(results["responses"])):
-        af = results["audio_files"][k]
-        if results["responses"][k] == answer_key[af]:
-            accuracy.append('CORRECT')
-        else:
-            accuracy.append('INCORRECT')
-    results["accuracy"] = accuracy
-
-    # counts the files in the results folder. Then sets PID to count + 1.
-    results_count = 0
-    results_dir = os.listdir(results_path)
-    for file in results_dir:
-        # checks results_dir for .csv files (indicating previous participants)
-        if file.endswith('.csv'):
-            results_count += 1
-    PID = results_count + 1
-    results["PID"] = [PID]*len(accuracy)
-    new_results = os.path.join(results_path,'results' + str(PID) + ".csv")
-    with open(new_results, 'w') as file:
-        # create writer
-        writer = csv.writer(file, delimiter = ",")
-        # write data keys
-        writer.writerow(results.keys())
-        # write values row wise
-        writer.writerows(zip_longest(*results.values())) # dict list values are unpacked first
-
-    # blit the results to the screen for 5 seconds before ending
-    blit_results(accuracy)
+    trace.enter("write_responses")
+    trial_journal.score_results(results, answer_key)
+    # allocate the next PID, save the trials and export results#.csv
+    PID = results_store.save_session(session_config["results_path"], results)
+    trace.exit("write_responses", PID)
+    return PID
 
 def blit_results(accuracy: list):
     """
@@ -434,31 +1477,11 @@ def blit_results(accuracy: list):
     for item in accuracy:
         if item == 'CORRECT':
             num_correct += 1
-    # render text items for results output and blits to center of screen
-    results_text = "You got ( " + str(num_correct) + " / " + str(num_items) + " )  correct."
-    results_item = exp_globals["font"].render(results_text, True, exp_globals["text_color"], exp_globals["bg_color"])
-    results_item_rect = results_item.get_rect()
-    results_item_rect.center = (exp_globals["screen_rect"].center[0], exp_globals["screen_rect"].center[1])
-
-    # fill background
-    exp_globals["screen"].fill(exp_globals["bg_color"])
-
-    # draw text to backbuffer
-    exp_globals["screen"].blit(results_item, results_item_rect)
-    pygame.display.flip()
-
-    # Loop to wait for SPACE bar or wait 5000 ms before ending
-    waiting = True
-    start_time = pygame.time.get_ticks()
-    while waiting:
-        if pygame.time.get_ticks() - start_time > 5000:
-            waiting = False
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                waiting = False
+    # show the results screen for this score, composed the first time it is seen
+    show_screen("results " + str(num_correct) + "/" + str(num_items))
+
+    # wait for any key or 5000 ms before ending
+    wait_for_event(any_key = True, timeout = 5000)
 
 
 def text_wrap_blit(surface: pygame.Surface, text: str, font: str, width: int, start_pos: tuple, color: tuple, after_spacing: int = 0, antialiasing: bool = True):
@@ -475,6 +1498,21 @@ def text_wrap_blit(surface: pygame.Surface, text: str, font: str, width: int, st
     after_spacing: int representing pixel spacing after new lines
     antialiasking: bool, if True, there will be smoothing of text
     """
+    # the word surfaces and positions are worked out once for each set of arguments
+    for word_surface, position in wrap_layout(text, font, width, start_pos, color, after_spacing, antialiasing):
+        surface.blit(word_surface, position)
+
+def wrap_layout(text: str, font: pygame.font.Font, width: int, start_pos: tuple, color: tuple, after_spacing: int = 0, antialiasing: bool = True):
+    """
+    Returns the wrapped layout used by text_wrap_blit as a list of (word
+    surface, position) pairs. Layouts are cached by text, font, width,
+    position, color and spacing, so each word is only rendered once.
+    Arguments are the same as for text_wrap_blit.
+    """
+    key = (text, font, width, start_pos, color, after_spacing, antialiasing)
+    if key in text_cache["layouts"]:
+        return text_cache["layouts"][key]
+    layout = []
     # get list of words row wise
     words = [word.split(' ') for word in text.splitlines()]
     # get size of spaces
@@ -495,14 +1533,27 @@ def text_wrap_blit(surface: pygame.Surface, text: str, font: str, width: int, st
                 x_pos = start_pos[0]
                 y_pos += word_height + after_spacing
 
-            # blit current word and update position
-            surface.blit(word_surface, (x_pos, y_pos))
+            # place current word and update position
+            layout.append((word_surface, (x_pos, y_pos)))
             x_pos += word_width + space
 
         # reset positions for each new line
         x_pos = start_pos[0]
         y_pos += word_height
 
+    text_cache["layouts"][key] = layout
+    return layout
+
 # == start the program == #
 if __name__ == '__main__':
-    run_expt()
+    configure_session()
+    # 'python statistical_learning_demo.py --calibrate' measures the mixer latency again
+    if '--calibrate' in sys.argv[1:]:
+        cache = load_cache()
+        cache.pop("mixer_calibration", None)
+        save_cache(cache)
+    # 'python statistical_learning_demo.py --kiosk' runs participants back to back
+    if '--kiosk' in sys.argv[1:]:
+        run_kiosk()
+    else:
+        run_expt()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Background stimulus decoding for statistical_learning_demo.py.
+
+Compressed stimuli (.flac or .ogg) are decoded by the pygame mixer to the PCM
+format the mixer was opened in. The decoded PCM is kept in an on-disk cache,
+named by the SHA-256 hash of the compressed file and the mixer format, so a
+stimulus is only decoded once per machine. Later launches read the PCM back
+and hand it to pygame.mixer.Sound(buffer=...). .wav files are already PCM
+and are loaded as they are.
+
+A DecodeAhead thread decodes a list of stimuli in the order they will be
+played, so that each one is ready before its trial starts. A stimulus that is
+needed before the thread has got to it is fetched: moved to the front of the
+queue, or waited for if it is being decoded, so it is never decoded twice at
+once.
+"""
+import os
+import threading
+from collections import deque
+import pygame
+
+# name of the PCM cache subfolder in the cache folder
+pcm_folder = 'pcm'
+
+
+def pcm_path(cache_path: str, sha256: str):
+    """
+    Returns the path of the cached PCM of the file with hash sha256 in the
+    format the mixer is open in.
+    cache_path: str representing the full path to the cache folder
+    sha256: str representing the hash of the compressed file
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    return os.path.join(cache_path, pcm_folder, '{}-{}-{}-{}.pcm'.format(sha256, frequency, size, channels))
+
+
+def decode(audio_file: str, sha256: str = None, cache_path: str = None):
+    """
+    Returns a pygame.mixer.Sound of audio_file. A compressed file is taken
+    from the PCM cache if it is there, and otherwise decoded and added to it.
+    A cache that cannot be written is skipped.
+    audio_file: str representing the full path to an audio file
+    sha256: str representing the hash of the file from the stimulus manifest,
+    None decodes without the cache
+    cache_path: str representing the full path to the cache folder
+    """
+    if audio_file.lower().endswith('.wav') or sha256 is None or cache_path is None:
+        return pygame.mixer.Sound(audio_file)
+    cached = pcm_path(cache_path, sha256)
+    try:
+        with open(cached, 'rb') as file:
+            return pygame.mixer.Sound(buffer = file.read())
+    except FileNotFoundError:
+        pass
+    sound = pygame.mixer.Sound(audio_file)
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok = True)
+        # write under a temporary name so that a half written file is never read
+        partial = cached + '.' + str(os.getpid())
+        with open(partial, 'wb') as file:
+            file.write(sound.get_raw())
+        os.replace(partial, cached)
+    except OSError:
+        pass
+    return sound
+
+
+class DecodeAhead:
+    """
+    Loads audio files on a background thread in the order they are queued.
+    load is called with each full path and does the decoding and storing
+    (e.g. into the stimulus bank of the demo). Files for which skip returns
+    True (e.g. because they are already decoded) are passed over. A file is
+    queued at most once at a time.
+    load: callable taking the full path to an audio file
+    skip: callable taking the full path, returns True if it needs no loading
+    """
+
+    def __init__(self, load, skip):
+        self.load = load
+        self.skip = skip
+        # files still to be loaded, in order, and the one being loaded
+        self.pending = deque()
+        self.current = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target = self.run, name = "decode-ahead", daemon = True)
+        self.thread.start()
+
+    def busy(self, audio_file: str):
+        """returns True if audio_file is queued or being loaded. Call with the condition held."""
+        return audio_file == self.current or audio_file in self.pending
+
+    def schedule(self, audio_files: list):
+        """queues audio files to be loaded after the ones already queued, unless they already are. Never blocks."""
+        with self.condition:
+            for audio_file in audio_files:
+                if not self.busy(audio_file):
+                    self.pending.append(audio_file)
+            self.condition.notify_all()
+
+    def fetch(self, audio_file: str):
+        """
+        Loads audio_file before every other queued file and blocks until it is
+        loaded. If it is being loaded already it is waited for instead of being
+        loaded again. Returns straight away once the thread is stopped.
+        audio_file: str representing the full path to an audio file
+        """
+        with self.condition:
+            if self.closed:
+                return
+            if audio_file != self.current:
+                if audio_file in self.pending:
+                    self.pending.remove(audio_file)
+                self.pending.appendleft(audio_file)
+                self.condition.notify_all()
+            while not self.closed and self.busy(audio_file):
+                self.condition.wait()
+
+    def wait(self):
+        """blocks until every file queued so far is loaded."""
+        with self.condition:
+            while not self.closed and (self.pending or self.current is not None):
+                self.condition.wait()
+
+    def close(self):
+        """drops the files not loaded yet and stops the thread once the current one is done."""
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                audio_file = self.current = self.pending.popleft()
+            try:
+                if not self.skip(audio_file):
+                    self.load(audio_file)
+            except Exception:
+                # a file that cannot be decoded here is decoded again, and
+                # fails loudly, when it is played
+                pass
+            finally:
+                with self.condition:
+                    self.current = None
+                    self.condition.notify_all()
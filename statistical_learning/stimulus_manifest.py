@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Stimulus manifest for statistical_learning_demo.py.
+
+The manifest is a .json index of the stimulus folder, kept in the folder as
+manifest.json. Stimuli can be .wav, .flac or .ogg (Vorbis) files. For every
+stimulus it records the format, sample rate, sample width, channels,
+duration, size and a SHA-256 hash of the file contents, and for every test
+file the correct answer (1 or 2). The demo loads the test file names and the
+answer key from the manifest instead of listing the folder, and checks the
+stimuli against it at startup.
+
+Build (or rebuild) the manifest after adding, removing or editing stimuli.
+The answers of files that are already in the manifest are kept, new test
+files need an answer:
+    python stimulus_manifest.py demo_audio
+    python stimulus_manifest.py demo_audio --answer Q9.wav=2
+Check every file against its hash:
+    python stimulus_manifest.py demo_audio --verify
+"""
+import os
+import json
+import wave
+import struct
+import hashlib
+import argparse
+
+# name of the manifest file in the stimulus folder
+manifest_name = 'manifest.json'
+
+# name of the training stream in the stimulus folder, without the extension
+training_stem = 'TrainingFile'
+
+# stimulus file formats the builder can read, by file extension
+audio_formats = {'.wav': 'wav', '.flac': 'flac', '.ogg': 'ogg'}
+
+
+def manifest_path(audio_path: str):
+    """returns the full path to the manifest of the stimulus folder audio_path."""
+    return os.path.join(audio_path, manifest_name)
+
+
+def file_hash(audio_file: str):
+    """
+    Returns the SHA-256 hex digest of the contents of a file.
+    audio_file: str representing the full path to the file
+    """
+    digest = hashlib.sha256()
+    with open(audio_file, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_wav_header(audio_file: str):
+    """returns the (sample rate, sample width in bytes, channels, frames) of a .wav file."""
+    with wave.open(audio_file, 'rb') as wav:
+        return wav.getframerate(), wav.getsampwidth(), wav.getnchannels(), wav.getnframes()
+
+
+def read_flac_header(audio_file: str):
+    """returns the (sample rate, sample width in bytes, channels, frames) of a .flac file."""
+    with open(audio_file, 'rb') as file:
+        header = file.read(42)
+    # 'fLaC', the 4 byte header of the STREAMINFO block, then 10 bytes of
+    # block and frame sizes before the packed stream info
+    if header[:4] != b'fLaC' or header[4] & 0x7f != 0:
+        raise ValueError(audio_file + " is not a FLAC file")
+    info = int.from_bytes(header[18:26], 'big')
+    frequency = info >> 44
+    channels = ((info >> 41) & 0x7) + 1
+    bits = ((info >> 36) & 0x1f) + 1
+    frames = info & 0xfffffffff
+    return frequency, (bits + 7) // 8, channels, frames
+
+
+def read_ogg_header(audio_file: str):
+    """
+    returns the (sample rate, sample width in bytes, channels, frames) of an
+    .ogg Vorbis file. Vorbis is decoded to 16 bit samples. The frame count is
+    the granule position of the last page.
+    """
+    with open(audio_file, 'rb') as file:
+        first = file.read(64 * 1024)
+        file.seek(max(0, os.path.getsize(audio_file) - 64 * 1024))
+        last = file.read()
+    # the identification packet follows the 27 byte page header and its segment table
+    packet = 27 + first[26]
+    if first[:4] != b'OggS' or first[packet:packet + 7] != b'\x01vorbis':
+        raise ValueError(audio_file + " is not an Ogg Vorbis file")
+    channels = first[packet + 11]
+    frequency = struct.unpack('<I', first[packet + 12:packet + 16])[0]
+    page = last.rfind(b'OggS')
+    frames = struct.unpack('<q', last[page + 6:page + 14])[0]
+    return frequency, 2, channels, frames
+
+
+# header readers by format
+header_readers = {'wav': read_wav_header, 'flac': read_flac_header, 'ogg': read_ogg_header}
+
+
+def describe_file(audio_file: str):
+    """
+    Returns the manifest entry (without role and answer) of one stimulus file.
+    Only the header of the file is read, besides hashing it.
+    audio_file: str representing the full path to a stimulus file
+    """
+    entry = {"format": audio_formats[os.path.splitext(audio_file)[1].lower()]}
+    entry["frequency"], entry["sampwidth"], entry["channels"], entry["frames"] = header_readers[entry["format"]](audio_file)
+    entry["duration_ms"] = round(entry["frames"] * 1000 / entry["frequency"], 3)
+    entry["size"] = os.path.getsize(audio_file)
+    entry["sha256"] = file_hash(audio_file)
+    return entry
+
+
+def load_manifest(audio_path: str):
+    """
+    Returns the manifest of the stimulus folder audio_path, or None if there
+    is none.
+    audio_path: str representing the full path to the stimulus folder
+    """
+    try:
+        with open(manifest_path(audio_path), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def build_manifest(audio_path: str, answers: dict = None):
+    """
+    Scans the stimulus folder once and returns its manifest. Test files are
+    the stimuli beginning with 'Q'. Their answers come from answers, then from
+    the existing manifest. Answers are matched by the name without the
+    extension, so they are kept when a stimulus is converted to another
+    format. Raises ValueError if a test file has no answer.
+    audio_path: str representing the full path to the stimulus folder
+    answers: dict mapping test file names to the correct sound (1 or 2)
+    """
+    old = load_manifest(audio_path) or {"files": {}}
+    known = {os.path.splitext(name)[0]: entry["answer"] for name, entry in old["files"].items() if entry.get("answer")}
+    known.update((os.path.splitext(name)[0], answer) for name, answer in (answers or {}).items())
+
+    files = {}
+    missing = []
+    training_name = training_stem + '.wav'
+    for name in sorted(os.listdir(audio_path)):
+        stem, extension = os.path.splitext(name)
+        if extension.lower() not in audio_formats:
+            continue
+        if stem == training_stem:
+            role = "training"
+            training_name = name
+        elif name.startswith('Q'):
+            role = "test"
+        else:
+            continue
+        entry = {"role": role}
+        entry.update(describe_file(os.path.join(audio_path, name)))
+        if role == "test":
+            if stem not in known:
+                missing.append(name)
+            entry["answer"] = known.get(stem)
+        files[name] = entry
+    if missing:
+        raise ValueError("no answer for " + ", ".join(missing) + " (use --answer NAME=1 or NAME=2)")
+    return {"version": 1, "training_file": training_name, "files": files}
+
+
+def save_manifest(audio_path: str, manifest: dict):
+    """
+    Writes the manifest to the stimulus folder audio_path.
+    manifest: dict from build_manifest
+    """
+    with open(manifest_path(audio_path), 'w') as file:
+        json.dump(manifest, file, indent = 1)
+        file.write('\n')
+
+
+def test_files(manifest: dict):
+    """returns the sorted names of the test files in the manifest."""
+    return sorted(name for name, entry in manifest["files"].items() if entry["role"] == "test")
+
+
+def answer_key(manifest: dict):
+    """returns a dict mapping each test file name in the manifest to its answer."""
+    return {name: manifest["files"][name]["answer"] for name in test_files(manifest)}
+
+
+def check_files(manifest: dict, audio_path: str, names: list, verified: dict):
+    """
+    Checks that the stimuli called names are in the manifest and unchanged on
+    disk, and returns a list of problems (empty if all is well). Each file is
+    only stat'ed: a file whose size and modification time are in verified is
+    taken as unchanged, and any other file is hashed once and added to
+    verified if it matches. Nothing is listed or read otherwise.
+    manifest: dict from load_manifest
+    audio_path: str representing the full path to the stimulus folder
+    names: list of stimulus file names to check
+    verified: dict mapping file names to the [size, mtime_ns, sha256] of a
+    copy that matched its hash. Updated in place.
+    """
+    problems = []
+    for name in names:
+        entry = manifest["files"].get(name)
+        if entry is None:
+            problems.append(name + " is not in the manifest")
+            continue
+        audio_file = os.path.join(audio_path, name)
+        try:
+            stat = os.stat(audio_file)
+        except FileNotFoundError:
+            problems.append(name + " is missing")
+            continue
+        if verified.get(name) == [stat.st_size, stat.st_mtime_ns, entry["sha256"]]:
+            continue
+        if stat.st_size != entry["size"] or file_hash(audio_file) != entry["sha256"]:
+            problems.append(name + " has changed since the manifest was built")
+            continue
+        verified[name] = [stat.st_size, stat.st_mtime_ns, entry["sha256"]]
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "build or verify the stimulus manifest of a stimulus folder")
+    parser.add_argument("audio_path", help = "stimulus folder, e.g. demo_audio")
+    parser.add_argument("--answer", action = "append", default = [], metavar = "NAME=1|2", help = "answer of a test file (repeatable)")
+    parser.add_argument("--verify", action = "store_true", help = "hash every file and compare it to the manifest")
+    args = parser.parse_args()
+    audio_path = os.path.abspath(args.audio_path)
+
+    if args.verify:
+        manifest = load_manifest(audio_path)
+        if manifest is None:
+            parser.error("no " + manifest_name + " in " + audio_path)
+        problems = check_files(manifest, audio_path, sorted(manifest["files"]), {})
+        for problem in problems:
+            print(problem)
+        print("{} files, {} problems".format(len(manifest["files"]), len(problems)))
+        raise SystemExit(1 if problems else 0)
+
+    answers = {}
+    for item in args.answer:
+        name, _, answer = item.partition('=')
+        if answer not in ('1', '2'):
+            parser.error("bad --answer " + item)
+        answers[name] = int(answer)
+    manifest = build_manifest(audio_path, answers)
+    save_manifest(audio_path, manifest)
+    print("{} test files, training file {}".format(len(test_files(manifest)),
+          manifest["training_file"] if manifest["training_file"] in manifest["files"] else "NOT FOUND"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Training stream synthesis for statistical_learning_demo.py.
+
+A training stream is a sequence of syllables drawn from a transitional
+probability grammar and joined with short crossfades, so that every
+participant can hear a different (counterbalanced) exposure stream instead of
+the one recorded TrainingFile.wav. The syllable inventory is a folder with one
+.wav file per syllable (e.g. syllables/pa.wav), all in the same format. The
+grammar is a .json file that names the inventory folder (relative to the
+grammar file) and either the words of the language or the transition table:
+
+{"inventory": "syllables",
+ "crossfade_ms": 10,
+ "length": 270,
+ "words": [["pa", "bi", "ku"], ["ti", "bu", "do"], ...]}
+
+With "words", syllables within a word always follow each other and a word is
+followed by any other word with equal probability, as in Saffran, Aslin, and
+Newport (1996). Instead of "words", "transitions" can give P(B|A) directly as
+{"pa": {"bi": 1.0}, ...}, with an optional "start" syllable.
+
+A stream is built with numpy in one overlap-add pass and comes back as 16 bit
+samples that can be given to pygame.mixer.Sound(buffer=...) as they are.
+Many streams can be built at once over a pool of processes:
+    python stream_synthesis.py grammar.json --streams 40 --out streams
+"""
+import os
+import json
+import wave
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+
+def load_inventory(inventory_path: str):
+    """
+    Reads every .wav file in inventory_path and returns a dict mapping the
+    syllable (the file name without .wav) to its mono float samples, and the
+    sample rate. Raises ValueError if the files do not share one sample rate.
+    inventory_path: str representing the full path to the syllable folder
+    """
+    syllables = {}
+    rates = set()
+    for name in sorted(os.listdir(inventory_path)):
+        if not name.endswith('.wav'):
+            continue
+        with wave.open(os.path.join(inventory_path, name), 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(name + " is not a 16 bit .wav file")
+            rates.add(wav.getframerate())
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype = '<i2').astype(np.float32)
+            syllables[name[:-4]] = samples.reshape(-1, wav.getnchannels()).mean(axis = 1)
+    if len(rates) != 1:
+        raise ValueError("the syllables in " + inventory_path + " need one common sample rate")
+    return syllables, rates.pop()
+
+
+def word_transitions(words: list):
+    """
+    Returns the transition table of a word language: each syllable of a word
+    is followed by the next one with probability 1, and the last syllable of a
+    word by the first syllable of each other word with equal probability.
+    Raises ValueError for fewer than two words, an empty word or a syllable
+    that is used more than once, since the table would then not be the one of
+    the words.
+    words: list of words, each a list of syllables
+    """
+    if len(words) < 2:
+        raise ValueError("a word grammar needs at least two words")
+    if not all(words):
+        raise ValueError("a word grammar cannot have an empty word")
+    seen = set()
+    for word in words:
+        repeated = seen.intersection(word) or set(syllable for syllable in word if word.count(syllable) > 1)
+        if repeated:
+            raise ValueError("syllables are used more than once in the words: " + ", ".join(sorted(repeated)))
+        seen.update(word)
+    transitions = {}
+    for word in words:
+        for first, second in zip(word[:-1], word[1:]):
+            transitions[first] = {second: 1.0}
+        others = [other[0] for other in words if other is not word]
+        transitions[word[-1]] = {syllable: 1.0 / len(others) for syllable in others}
+    return transitions
+
+
+def load_grammar(grammar_file: str):
+    """
+    Reads a grammar .json file and its syllable inventory. Returns the grammar
+    dict with the inventory samples under "syllables", the sample rate under
+    "frequency" and the transition table under "transitions". Raises
+    ValueError for a grammar that would not produce its language (see
+    word_transitions and check_transitions) or a syllable without a recording.
+    grammar_file: str representing the full path to the grammar .json file
+    """
+    with open(grammar_file, 'r') as file:
+        grammar = json.load(file)
+    inventory_path = os.path.join(os.path.dirname(os.path.abspath(grammar_file)), grammar["inventory"])
+    grammar["syllables"], grammar["frequency"] = load_inventory(inventory_path)
+    if "words" in grammar:
+        grammar["transitions"] = word_transitions(grammar["words"])
+        grammar.setdefault("length", 45 * sum(len(word) for word in grammar["words"]))
+    check_transitions(grammar)
+    missing = set(grammar["transitions"]) - set(grammar["syllables"])
+    if missing:
+        raise ValueError("no recording of " + ", ".join(sorted(missing)) + " in " + inventory_path)
+    return grammar
+
+
+def check_transitions(grammar: dict):
+    """
+    Raises ValueError if a syllable of the transition table has no following
+    syllables, negative probabilities or probabilities that do not add up to
+    a positive value, if it can be followed by a syllable that has no row of
+    its own, or if the start syllable has no row.
+    grammar: dict with the transition table under "transitions"
+    """
+    transitions = grammar["transitions"]
+    if not transitions:
+        raise ValueError("the grammar has no transitions")
+    for first, row in transitions.items():
+        if not row or any(probability < 0 for probability in row.values()) or sum(row.values()) <= 0:
+            raise ValueError("the transitions from " + first + " must be non negative and add up to more than 0")
+        unknown = set(row) - set(transitions)
+        if unknown:
+            raise ValueError(first + " can be followed by syllables without transitions: " + ", ".join(sorted(unknown)))
+    if "start" in grammar and grammar["start"] not in transitions:
+        raise ValueError("the start syllable " + grammar["start"] + " has no transitions")
+
+
+def syllable_sequence(grammar: dict, rng: np.random.Generator):
+    """
+    Returns a list of grammar["length"] syllables drawn from the transition
+    table of the grammar, starting from grammar["start"] or a random syllable.
+    grammar: dict from load_grammar
+    rng: numpy random generator
+    """
+    names = sorted(grammar["transitions"])
+    number = {name: k for k, name in enumerate(names)}
+    # cumulative transition probabilities, one row per syllable
+    table = np.zeros((len(names), len(names)))
+    for first, row in grammar["transitions"].items():
+        for second, probability in row.items():
+            table[number[first], number[second]] = probability
+    table = np.cumsum(table / table.sum(axis = 1, keepdims = True), axis = 1)
+
+    draws = rng.random(grammar["length"])
+    current = number[grammar["start"]] if "start" in grammar else int(draws[0] * len(names))
+    sequence = [current]
+    for draw in draws[1:]:
+        current = min(int(np.searchsorted(table[current], draw, side = 'right')), len(names) - 1)
+        sequence.append(current)
+    return [names[k] for k in sequence]
+
+
+def join_syllables(sequence: list, syllables: dict, fade: int):
+    """
+    Joins the syllables of sequence into one stream, each overlapping the one
+    before it by fade samples with linear fades, and returns the 16 bit
+    samples. All syllables are overlap-added in a single numpy pass.
+    sequence: list of syllable names
+    syllables: dict mapping syllable names to mono float samples
+    fade: int representing the length of the crossfades in samples
+    """
+    # fade every recording in and out once, then look the pieces up
+    names = sorted(set(sequence))
+    faded = []
+    for name in names:
+        samples = syllables[name].copy()
+        length = min(fade, len(samples) // 2)
+        ramp = np.linspace(0.0, 1.0, length + 2, dtype = np.float32)[1:-1]
+        samples[:length] *= ramp
+        samples[len(samples) - length:] *= ramp[::-1]
+        faded.append(samples)
+    number = {name: k for k, name in enumerate(names)}
+    order = np.array([number[name] for name in sequence])
+    lengths = np.array([len(samples) for samples in faded])[order]
+
+    # each piece starts fade samples before the end of the one before it
+    starts = np.concatenate(([0], np.cumsum(lengths[:-1] - fade)))
+    starts = np.maximum(starts, 0)
+    pieces = np.concatenate([faded[k] for k in order])
+    offsets = np.arange(len(pieces)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    positions = np.repeat(starts, lengths) + offsets
+    stream = np.bincount(positions, weights = pieces, minlength = int(starts[-1] + lengths[-1]))
+    return np.clip(stream, -32768, 32767).astype(np.int16)
+
+
+def synthesize(grammar: dict, seed: int = None):
+    """
+    Builds one training stream. Returns the 16 bit mono samples and the list
+    of syllables in the stream.
+    grammar: dict from load_grammar
+    seed: int used to seed the syllable sequence
+    """
+    sequence = syllable_sequence(grammar, np.random.default_rng(seed))
+    fade = int(grammar.get("crossfade_ms", 10) * grammar["frequency"] / 1000)
+    return join_syllables(sequence, grammar["syllables"], fade), sequence
+
+
+def mixer_buffer(stream, channels: int):
+    """
+    Returns the samples of stream laid out for a 16 bit mixer with channels
+    channels, ready for pygame.mixer.Sound(buffer=...). A mono stream for a
+    mono mixer is returned as it is, without a copy.
+    stream: 16 bit mono samples from synthesize
+    channels: int representing the channel count of the mixer
+    """
+    if channels == 1:
+        return stream
+    return np.ascontiguousarray(np.repeat(stream[:, None], channels, axis = 1))
+
+
+# grammar of the worker processes of synthesize_batch, loaded once per worker
+worker_grammar = {}
+
+
+def load_worker_grammar(grammar_file: str):
+    worker_grammar.update(load_grammar(grammar_file))
+
+
+def synthesize_seed(seed: int):
+    stream, sequence = synthesize(worker_grammar, seed)
+    return seed, stream, sequence
+
+
+def synthesize_batch(grammar_file: str, seeds: list, workers: int = None):
+    """
+    Builds one training stream per seed over a pool of worker processes and
+    returns a list of (seed, samples, syllables). Each worker reads the
+    grammar and the inventory only once.
+    grammar_file: str representing the full path to the grammar .json file
+    seeds: list of int, one per stream
+    workers: int representing the number of worker processes, None uses all cores
+    """
+    with ProcessPoolExecutor(max_workers = workers, initializer = load_worker_grammar, initargs = (grammar_file,)) as pool:
+        return list(pool.map(synthesize_seed, seeds, chunksize = max(1, len(seeds) // (4 * (workers or os.cpu_count() or 1)))))
+
+
+def write_stream(out_path: str, seed: int, stream, sequence: list, frequency: int):
+    """
+    Writes a stream as stream<seed>.wav in out_path, and its syllables as
+    stream<seed>.json in the "training" layout of the transcription files of
+    simulated_participants.py.
+    """
+    with wave.open(os.path.join(out_path, 'stream{}.wav'.format(seed)), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(frequency)
+        wav.writeframes(stream.tobytes())
+    with open(os.path.join(out_path, 'stream{}.json'.format(seed)), 'w') as file:
+        json.dump({"seed": seed, "training": ' '.join(sequence)}, file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "synthesize training streams from a syllable inventory and a grammar")
+    parser.add_argument("grammar_file", help = "grammar .json file")
+    parser.add_argument("--streams", type = int, default = 1, help = "number of streams")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the first stream")
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: all cores)")
+    parser.add_argument("--out", default = "streams", help = "folder to write the streams to")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok = True)
+    frequency = load_grammar(args.grammar_file)["frequency"]
+    seeds = list(range(args.seed, args.seed + args.streams))
+    for seed, stream, sequence in synthesize_batch(os.path.abspath(args.grammar_file), seeds, args.workers):
+        write_stream(args.out, seed, stream, sequence, frequency)
+    print("{} streams written to {}".format(len(seeds), args.out))
+
+
+if __name__ == '__main__':
+    main()
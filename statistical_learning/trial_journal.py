@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Crash safe trial journal for statistical_learning_demo.py.
+
+Each session appends its trials to a journal file (one JSON record per line)
+in the 'journal' subfolder of the results folder as soon as they are
+recorded. The writes happen on a background thread, which syncs the file to
+disk in batches, so the experiment never waits on the disk. The first record
+of a journal describes the session, an end record is written once the
+session has been saved to the results store, and a keys record lists every
+key press of the session with its time from the onset of its screen (see
+session_replay.py).
+
+A journal without an end record belongs to a session that crashed or was
+closed early. The recovery tool saves the trials of such sessions to the
+results store and exports them as results#.csv. Run it while no session is
+running on a station that writes to the same folder:
+    python trial_journal.py demo_results
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from datetime import datetime
+from collections import OrderedDict
+import results_store
+
+# name of the journal subfolder in the results folder
+journal_folder = 'journal'
+
+# queue item that asks the writer thread to sync the journal to disk
+SYNC = object()
+
+
+class TrialJournal:
+    """
+    Appends records to a journal file on a background writer thread. Records
+    are written as soon as the thread gets them, and the file is synced to
+    disk at most every sync_interval seconds, or straight away by flush and
+    close. Jobs (callables) can be queued too. They run on the writer thread
+    after every record queued before them is on disk. A job that fails does
+    not stop the thread; the first error is kept and raised by close.
+    journal_path: str representing the full path to the journal file
+    sync_interval: float representing the longest time in seconds that a
+    written record can wait before it is synced to disk
+    """
+
+    def __init__(self, journal_path: str, sync_interval: float = 0.25):
+        self.path = journal_path
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue()
+        # first exception raised by a job, raised again by close
+        self.error = None
+        self.file = open(journal_path, 'a')
+        self.thread = threading.Thread(target = self.run, name = "trial-journal", daemon = True)
+        self.thread.start()
+
+    def append(self, record: dict):
+        """queues a record to be written. Never blocks on the disk."""
+        self.queue.put(record)
+
+    def submit(self, job):
+        """queues a callable to run on the writer thread once earlier records are on disk."""
+        self.queue.put(job)
+
+    def flush(self):
+        """blocks until every record queued so far is synced to disk."""
+        done = threading.Event()
+        self.queue.put(done.set)
+        done.wait()
+
+    def close(self):
+        """
+        Syncs every queued record, runs queued jobs and stops the writer
+        thread. Raises the first exception of a job that failed.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write_now(self, record: dict):
+        """writes a record and syncs it straight away. Only for jobs running on the writer thread."""
+        self.file.write(json.dumps(record) + '\n')
+        self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def run(self):
+        dirty = False
+        last_sync = time.monotonic()
+        while True:
+            # wait for the next item, but wake up in time to sync written records
+            timeout = None
+            if dirty:
+                timeout = max(0.0, self.sync_interval - (time.monotonic() - last_sync))
+            try:
+                item = self.queue.get(timeout = timeout)
+            except queue.Empty:
+                item = SYNC
+            if isinstance(item, dict):
+                self.file.write(json.dumps(item) + '\n')
+                dirty = True
+                # sync a batch once the queue is empty and the interval is over
+                if not self.queue.empty() or time.monotonic() - last_sync < self.sync_interval:
+                    continue
+                item = SYNC
+            # everything before a job, a sync or the stop signal goes to disk first
+            if dirty:
+                self.sync()
+                dirty = False
+                last_sync = time.monotonic()
+            if item is None:
+                self.file.close()
+                return
+            if item is not SYNC:
+                try:
+                    item()
+                except Exception as error:
+                    if self.error is None:
+                        self.error = error
+
+
+def new_journal_path(results_path: str):
+    """
+    Returns the path for a new journal in the journal subfolder of
+    results_path, named by the start time and the process ID.
+    results_path: str representing the full path to the results folder
+    """
+    folder = os.path.join(results_path, journal_folder)
+    os.makedirs(folder, exist_ok = True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    return os.path.join(folder, 'session-{}-{}.jsonl'.format(stamp, os.getpid()))
+
+
+def read_journal(journal_path: str):
+    """
+    Returns the records of a journal. A line that was only partly written
+    before a crash is skipped.
+    journal_path: str representing the full path to the journal file
+    """
+    records = []
+    with open(journal_path, 'r') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def results_from_journal(records: list):
+    """
+    Rebuilds a results dictionary in the layout of results_out from the
+    records of a journal. PID and accuracy are left as None.
+    records: list of journal records from read_journal
+    """
+    header = records[0]
+    results = OrderedDict((key, [] if key in header["trial_keys"] else None) for key in header["columns"])
+    for record in records:
+        if record["type"] == "trial":
+            for key in header["trial_keys"]:
+                results[key].append(record.get(key))
+    return results
+
+
+def score_results(results: dict, answer_key: dict):
+    """
+    Fills results["accuracy"] by comparing each response to answer_key and
+    returns the accuracy list.
+    results: dictionary representing the trial by trial data and results
+    answer_key: dict mapping test audio file names to the correct sound
+    """
+    accuracy = []
+    for k in range(len(results["responses"])):
+        if results["responses"][k] == answer_key[results["audio_files"][k]]:
+            accuracy.append('CORRECT')
+        else:
+            accuracy.append('INCORRECT')
+    results["accuracy"] = accuracy
+    return accuracy
+
+
+def is_finished(records: list):
+    """returns True if the session of a journal was saved to the results store."""
+    return any(record["type"] == "end" for record in records)
+
+
+def recover_journals(results_path: str):
+    """
+    Saves every session in the journal subfolder of results_path that was not
+    saved to the results store, and marks its journal as finished. Returns a
+    list of (journal file, PID, number of trials) for the recovered sessions.
+    results_path: str representing the full path to the results folder
+    """
+    folder = os.path.join(results_path, journal_folder)
+    if not os.path.isdir(folder):
+        return []
+    recovered = []
+    for name in sorted(os.listdir(folder)):
+        journal_path = os.path.join(folder, name)
+        records = read_journal(journal_path)
+        if not records or is_finished(records):
+            continue
+        results = results_from_journal(records)
+        PID = None
+        # a session that ended before its first trial has nothing to save
+        if results["responses"]:
+            score_results(results, records[0]["answer_key"])
+            PID = results_store.save_session(results_path, results)
+        with open(journal_path, 'a+') as file:
+            # end a partly written last line first, so the end record is on its own line
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:
+                file.seek(file.tell() - 1)
+                if file.read(1) != '\n':
+                    file.write('\n')
+            file.write(json.dumps({"type": "end", "PID": PID, "recovered": True}) + '\n')
+        recovered.append((name, PID, len(results["responses"])))
+    return recovered
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "save sessions that crashed or were closed early from their journals")
+    parser.add_argument("results_path", help = "results folder that holds the journal subfolder")
+    args = parser.parse_args()
+    for name, PID, n_trials in recover_journals(os.path.abspath(args.results_path)):
+        if PID is None:
+            print("{}: no trials to save".format(name))
+        else:
+            print("{}: saved {} trials as results{}.csv".format(name, n_trials, PID))
+
+
+if __name__ == '__main__':
+    main()
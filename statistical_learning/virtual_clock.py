@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Clocks and event sources for statistical_learning_demo.py.
+
+The demo takes every timestamp, waits, plays its sounds and gets its events
+through the clock in exp_globals["events"] instead of calling pygame.time and
+pygame.event directly. PygameClock is the real one: it reads
+time.perf_counter_ns and the pygame event queue, and plays sounds on the
+mixer.
+
+VirtualClock keeps its own time and its own queue of scheduled events. A wait
+moves the virtual time on without sleeping, a sound schedules the end event
+of its channel at the end of its length, and the key presses come from a
+press function that is asked for a key every time the experiment waits for
+one. A session on a virtual clock takes the same virtual time as the real
+session, but runs as fast as the code does. Headless runs (see
+headless_runner.py) and replays of recorded sessions (see session_replay.py)
+use it.
+"""
+import time
+import heapq
+import itertools
+import pygame
+
+
+class PygameClock:
+    """the real clock and the pygame event queue."""
+
+    realtime = True
+
+    def now_ns(self):
+        """returns the time in nanoseconds on a monotonic clock."""
+        return time.perf_counter_ns()
+
+    def ticks(self):
+        """returns the milliseconds since pygame.init, as pygame.time.get_ticks."""
+        return pygame.time.get_ticks()
+
+    def wait(self, duration: int):
+        """sleeps for duration milliseconds."""
+        pygame.time.wait(duration)
+
+    def pace(self, clock: pygame.time.Clock, FPS: int):
+        """waits until a screen update is due so there are at most FPS per second."""
+        clock.tick(FPS)
+
+    def next_event(self):
+        """blocks until the next event arrives and returns it."""
+        return pygame.event.wait()
+
+    def post(self, event: pygame.event.Event):
+        pygame.event.post(event)
+
+    def clear(self, event_type: int = None):
+        """drops the queued events of event_type, or all queued events if None."""
+        if event_type is None:
+            pygame.event.clear()
+        else:
+            pygame.event.clear(event_type)
+
+    def set_timer(self, event_type: int, duration: int):
+        """posts one event_type event in duration milliseconds. 0 cancels the timer."""
+        pygame.time.set_timer(event_type, duration, loops = 1)
+
+    def play(self, channel: pygame.mixer.Channel, sound: pygame.mixer.Sound, length_ms: float):
+        """
+        Starts sound on channel, which posts its end event when the sound is
+        over. Without a sound (headless runs decode nothing) the end event is
+        posted straight away.
+        """
+        if sound is None:
+            pygame.event.post(pygame.event.Event(channel.get_endevent()))
+        else:
+            channel.play(sound)
+
+    def expect_keys(self, keys: tuple, any_key: bool):
+        """called when the experiment starts waiting for keys. Real keys come from the keyboard."""
+        pass
+
+
+class VirtualClock:
+    """
+    A clock that only moves when the session waits, with its own event
+    queue. press is called with the accepted keys and any_key every time the
+    session waits for a key, and returns (delay in ms, key) to press that key
+    delay milliseconds later, or None to press nothing (a wait with a timeout
+    then times out).
+    press: callable taking (keys, any_key), None presses nothing
+    """
+
+    realtime = False
+
+    def __init__(self, press = None):
+        self.press = press
+        self.time_ns = 0
+        # (time_ns, order, event) of every scheduled event, earliest first
+        self.queue = []
+        self.order = itertools.count()
+
+    def now_ns(self):
+        return self.time_ns
+
+    def ticks(self):
+        return self.time_ns // 1000000
+
+    def wait(self, duration: int):
+        self.time_ns += duration * 1000000
+
+    def pace(self, clock: pygame.time.Clock, FPS: int):
+        pass
+
+    def schedule(self, event: pygame.event.Event, delay_ms: float = 0):
+        """queues event to arrive delay_ms milliseconds from now."""
+        heapq.heappush(self.queue, (self.time_ns + round(delay_ms * 1e6), next(self.order), event))
+
+    def next_event(self):
+        """
+        Returns the next scheduled event and moves the time on to its arrival.
+        Raises RuntimeError if nothing is scheduled, since the session would
+        then wait forever.
+        """
+        if not self.queue:
+            raise RuntimeError("the session waits for an event but none is scheduled")
+        time_ns, order, event = heapq.heappop(self.queue)
+        self.time_ns = max(self.time_ns, time_ns)
+        return event
+
+    def post(self, event: pygame.event.Event):
+        self.schedule(event)
+
+    def clear(self, event_type: int = None):
+        self.queue = [item for item in self.queue if event_type is not None and item[2].type != event_type]
+        heapq.heapify(self.queue)
+
+    def set_timer(self, event_type: int, duration: int):
+        self.clear(event_type)
+        if duration > 0:
+            self.schedule(pygame.event.Event(event_type), duration)
+
+    def play(self, channel: pygame.mixer.Channel, sound: pygame.mixer.Sound, length_ms: float):
+        """schedules the end event of channel length_ms from now. Nothing is played."""
+        end_event = channel.get_endevent()
+        if end_event != pygame.NOEVENT:
+            self.schedule(pygame.event.Event(end_event), length_ms)
+
+    def expect_keys(self, keys: tuple, any_key: bool):
+        """schedules the key press the press function asks for, if any."""
+        pressed = self.press(keys, any_key) if self.press is not None else None
+        if pressed is not None:
+            delay_ms, key = pressed
+            self.schedule(pygame.event.Event(pygame.KEYDOWN, key = key), max(0, delay_ms))